@@ -0,0 +1,84 @@
+"""
+Synthetic verenigingen, shaped like the detail responses of the verenigingenregister
+(the `vereniging` object, with `etag` and `metadata` added by the detail fetcher).
+"""
+import random
+
+LOCATION_TYPES = ["Maatschappelijke zetel volgens KBO", "Correspondentie", "Activiteiten"]
+ASSOCIATION_TYPES = ["FV", "VZW", "IVZW", "PS", "AFD"]
+STATUSES = ["Actief", "Niet actief", "In oprichting", "Gestopt"]
+CONTACT_TYPES = ["E-mail", "Telefoon", "Website", "SocialMedia"]
+
+
+def make_vereniging(index, rng):
+    v_code = f"V{index:07d}"
+    locaties = []
+    for location_index in range(rng.randint(1, 4)):
+        postcode = str(rng.randint(1000, 9999))
+        locaties.append({
+            "@id": f"https://data.vereniging.be/{v_code}/locaties/{location_index}",
+            "@type": "org:Site",
+            "locatieId": location_index + 1,
+            "locatietype": rng.choice(LOCATION_TYPES),
+            "isPrimair": location_index == 0 and rng.random() < 0.7,
+            "naam": f"Locatie {location_index}",
+            "adresvoorstelling": f"Straat {location_index}, {postcode} Gemeente",
+            "adres": {
+                "@id": f"https://data.vereniging.be/{v_code}/adressen/{location_index}",
+                "@type": "locn:Address",
+                "straatnaam": "Straat",
+                "huisnummer": str(location_index),
+                "postcode": postcode,
+                "gemeente": "Gemeente",
+                "land": "België",
+            },
+            "verwijstNaar": {"@id": f"https://data.vlaanderen.be/id/adres/{rng.randint(1, 10**7)}"},
+        })
+    contactgegevens = [
+        {
+            "@id": f"https://data.vereniging.be/{v_code}/contactgegevens/{contact_index}",
+            "@type": "schema:ContactPoint",
+            "contactgegevenId": contact_index + 1,
+            "contactgegeventype": rng.choice(CONTACT_TYPES),
+            "waarde": f"contact-{contact_index}@example.org",
+            "isPrimair": contact_index == 0,
+        }
+        for contact_index in range(rng.randint(0, 3))
+    ]
+    vertegenwoordigers = [
+        {
+            "@id": f"https://data.vereniging.be/{v_code}/vertegenwoordigers/{representative_index}",
+            "@type": "person:Person",
+            "vertegenwoordigerId": representative_index + 1,
+            "voornaam": "Voornaam",
+            "achternaam": "Achternaam",
+            "isPrimair": representative_index == 0,
+            "vertegenwoordigerContactgegevens": {
+                "@id": f"https://data.vereniging.be/{v_code}/vertegenwoordigers/{representative_index}/contact",
+                "@type": "schema:ContactPoint",
+                "e-mail": "vertegenwoordiger@example.org",
+                "telefoon": "0123456789",
+            },
+        }
+        for representative_index in range(rng.randint(0, 3))
+    ]
+    return {
+        "@id": f"https://data.vereniging.be/id/vereniging/{v_code}",
+        "@type": "fei:FeitelijkeVereniging",
+        "vCode": v_code,
+        "naam": f"Vereniging {index}",
+        "verenigingstype": {"code": rng.choice(ASSOCIATION_TYPES), "naam": "Type"},
+        "status": rng.choice(STATUSES),
+        "sleutels": [{"@id": f"https://data.vereniging.be/{v_code}/sleutels/vr", "bron": "VR",
+                      "waarde": v_code, "codeerSysteem": "Vcode"}],
+        "locaties": locaties,
+        "contactgegevens": contactgegevens,
+        "vertegenwoordigers": vertegenwoordigers,
+        "etag": f'W/"{rng.randint(1, 10**6)}"',
+        "metadata": {"datumLaatsteAanpassing": "2025-01-01"},
+    }
+
+
+def make_corpus(size, seed=42):
+    rng = random.Random(seed)
+    return [make_vereniging(index, rng) for index in range(size)]
@@ -0,0 +1,85 @@
+"""
+Runs a full sync end-to-end (postcode searches, detail fetches, transform and the gzipped output file)
+against a local stand-in for the verenigingenregister, and reports requests/sec, p50/p99 latency and wall time.
+Latencies are measured client side, on the shared session of lblod.http_client.
+
+    python -m benchmarks.full_sync_benchmark [--size 10000] [--latency 0.05] [--error-rate 0.01] [--removed-rate 0.01]
+
+Takes the options of benchmarks.register_stub. The service's own settings (DETAIL_FETCH_CONCURRENCY,
+REGISTER_MAX_REQUESTS_PER_SECOND, JSON_CODEC, ...) are read from the environment as usual.
+"""
+import argparse
+import collections
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.register_stub import add_arguments, create_register_stub, stub_environment
+
+
+def percentile(values, fraction):
+    return values[min(int(fraction * len(values)), len(values) - 1)] if values else 0.0
+
+
+def run(args):
+    server = create_register_stub(args)
+    storage_path = tempfile.mkdtemp(prefix="full-sync-benchmark-")
+    # The service reads its configuration at import, so the environment is set up first.
+    os.environ.update(stub_environment(server))
+    os.environ.setdefault("ETAG_STORE_PATH", os.path.join(storage_path, "etag-store.sqlite"))
+    if not args.etag_store:
+        os.environ["ETAG_STORE_ENABLED"] = "false"
+
+    from lblod import file
+    from lblod.data_fetcher import iter_vcodes
+    from lblod.etag_store import get_etag_store
+    from lblod.http_client import get_session
+    from lblod.pipeline import stream_task
+
+    file.STORAGE_PATH = storage_path
+    latencies = []
+    statuses = collections.Counter()
+    lock = threading.Lock()
+
+    def record(response, *args, **kwargs):
+        with lock:
+            latencies.append(response.elapsed.total_seconds())
+            statuses[response.status_code] += 1
+
+    get_session().hooks["response"].append(record)
+
+    for run_index in range(args.runs):
+        latencies.clear()
+        statuses.clear()
+        task = {"uri": "http://data.lblod.info/id/tasks/full-sync-benchmark"}
+        start = time.perf_counter()
+        chunks = stream_task(task, iter_vcodes(task), os.environ["API_URL"], etag_store=get_etag_store())
+        adapter = file.save_json_stream_on_disk(chunks)
+        wall_time = time.perf_counter() - start
+
+        with gzip.open(adapter["physical_file_path"], "rt", encoding="utf-8") as output:
+            written = len(json.load(output)["verenigingen"])
+        os.remove(adapter["physical_file_path"])
+
+        ordered = sorted(latencies)
+        print(f"run {run_index + 1}: {written} of {len(server.data.details)} verenigingen written "
+              f"({len(server.data.removed)} removed), {adapter['size'] / 1024 / 1024:.1f} MB")
+        print(f"  wall time: {wall_time:.2f}s")
+        print(f"  requests:  {len(latencies)} ({len(latencies) / wall_time:,.0f} req/s), "
+              f"statuses: {dict(sorted(statuses.items()))}")
+        print(f"  latency:   p50 {percentile(ordered, 0.5) * 1000:.1f} ms, p99 {percentile(ordered, 0.99) * 1000:.1f} ms")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--runs", type=int, default=1,
+                        help="Number of full syncs; with --etag-store, the later ones are conditional")
+    parser.add_argument("--etag-store", action="store_true", help="Use an ETag store, in a temporary folder")
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,61 @@
+"""
+Compares the parse and serialise throughput of the JSON codecs in lblod.json_codec.
+Backends that aren't installed are skipped.
+
+By default it runs on a synthetic corpus. Pass --corpus with a file of recorded detail
+responses instead, either a JSON list or one response per line (NDJSON).
+
+    python -m benchmarks.json_benchmark [--size 20000] [--runs 3] [--corpus responses.ndjson]
+"""
+import argparse
+import json
+import time
+
+from benchmarks.corpus import make_corpus
+from lblod.json_codec import BACKENDS, CODECS
+
+
+def load_recorded_corpus(path):
+    with open(path, "r", encoding="utf-8") as file:
+        content = file.read()
+    if content.lstrip().startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def best_of(runs, call):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(corpus, runs):
+    # Parsing is measured on bytes, like the response bodies the fetchers get from requests.
+    bodies = [json.dumps({"vereniging": item}).encode("utf-8") for item in corpus]
+    total_bytes = sum(len(body) for body in bodies)
+    print(f"{len(corpus)} documents, {total_bytes / 1024 / 1024:.1f} MB, best of {runs} runs")
+
+    for backend in BACKENDS:
+        try:
+            loads, dumps = CODECS[backend]()
+        except ImportError:
+            print(f"{backend:>7}: not installed")
+            continue
+        assert [loads(body) for body in bodies[:100]] == [json.loads(body) for body in bodies[:100]]
+        parse = best_of(runs, lambda: [loads(body) for body in bodies])
+        serialise = best_of(runs, lambda: [dumps(item) for item in corpus])
+        print(f"{backend:>7}: parse {total_bytes / parse / 1024 / 1024:7.1f} MB/s ({parse:.3f}s), "
+              f"serialise {total_bytes / serialise / 1024 / 1024:7.1f} MB/s ({serialise:.3f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--corpus", help="File with recorded detail responses (JSON list or NDJSON)")
+    args = parser.parse_args()
+    corpus = load_recorded_corpus(args.corpus) if args.corpus else make_corpus(args.size)
+    run(corpus, args.runs)
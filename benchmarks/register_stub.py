@@ -0,0 +1,264 @@
+"""
+Local stand-in for the verenigingenregister, to exercise the fetch paths without the staging register.
+
+Serves, under any path prefix:
+- GET  .../verenigingen/zoeken?q=locaties.postcode:<postcode>&offset=&limit=
+- GET  .../verenigingen/mutaties?sinds=<sequence>
+- GET  .../verenigingen/<vCode>  (with ETag and If-None-Match support)
+- GET  .../context.json
+- POST .../v1/token
+
+Responses are replayed from recorded fixtures (--fixtures), or generated from the synthetic corpus.
+A fixtures folder holds one detail response per vereniging in `verenigingen/<vCode>.json`
+(the body as returned by the register), and optionally `context.json` and `mutaties.json`.
+
+Latency, throttling (429 with Retry-After) and removed verenigingen (404) can be injected.
+
+    python -m benchmarks.register_stub [--port 8080] [--size 10000] [--latency 0.05] [--error-rate 0.01] [--removed-rate 0.01]
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from benchmarks.corpus import make_corpus
+
+POSTAL_CODES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                 "lblod", "postal_codes.json")
+
+REMOVED_RESOURCE_BODY = {
+    "type": "urn:associationregistry.admin.api:validation",
+    "title": "Er heeft zich een fout voorgedaan!",
+    "detail": "Source: Deze vereniging werd verwijderd.",
+    "status": 404,
+}
+
+DEFAULT_CONTEXT = {"@context": {"@vocab": "https://data.vlaanderen.be/ns/FeitelijkeVerenigingen#"}}
+
+
+def load_postal_codes():
+    with open(POSTAL_CODES_PATH, "r") as file:
+        postal_codes = json.load(file)
+    return postal_codes["postal_codes_brussels"] + postal_codes["postal_codes_flanders"]
+
+
+class RegisterData:
+    """
+    The verenigingen served by the stand-in: their detail responses, a search index by postcode,
+    the mutations and the context. Built from fixtures or from the synthetic corpus.
+    """
+
+    def __init__(self, details, context=None, mutations=None):
+        self.details = {}
+        self.postcodes = {}
+        for v_code, body in details.items():
+            encoded = json.dumps(body).encode("utf-8")
+            self.details[v_code] = (f'W/"{zlib.crc32(encoded):x}"', encoded)
+            for locatie in body.get("vereniging", {}).get("locaties", []):
+                postcode = locatie.get("adres", {}).get("postcode")
+                if postcode and v_code not in self.postcodes.setdefault(postcode, []):
+                    self.postcodes[postcode].append(v_code)
+        self.context = json.dumps(context or DEFAULT_CONTEXT).encode("utf-8")
+        self.mutations = mutations if mutations is not None else [
+            {"vCode": v_code, "sequence": sequence + 1} for sequence, v_code in enumerate(self.details)
+        ]
+        self.removed = set()
+
+    def remove_random(self, rate, rng):
+        "Marks a fraction of the verenigingen as removed: they stay searchable, but their details answer 404"
+        self.removed = {v_code for v_code in self.details if rng.random() < rate}
+
+    @classmethod
+    def synthetic(cls, size, seed=42):
+        rng = random.Random(seed)
+        postal_codes = load_postal_codes()
+        details = {}
+        for vereniging in make_corpus(size, seed):
+            vereniging.pop("etag", None)
+            metadata = vereniging.pop("metadata", None)
+            for locatie in vereniging["locaties"]:
+                locatie["adres"]["postcode"] = rng.choice(postal_codes)
+            details[vereniging["vCode"]] = {"vereniging": vereniging, "metadata": metadata}
+        return cls(details)
+
+    @classmethod
+    def from_fixtures(cls, path):
+        details = {}
+        for detail_path in sorted(glob.glob(os.path.join(path, "verenigingen", "*.json"))):
+            with open(detail_path, "r", encoding="utf-8") as file:
+                details[os.path.splitext(os.path.basename(detail_path))[0]] = json.load(file)
+
+        def load_optional(name):
+            optional_path = os.path.join(path, name)
+            if not os.path.exists(optional_path):
+                return None
+            with open(optional_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+
+        return cls(details, load_optional("context.json"), load_optional("mutaties.json"))
+
+
+class RegisterStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    detail_path = re.compile(r".*/verenigingen/(?P<v_code>[^/]+)$")
+
+    def do_GET(self):
+        server = self.server
+        server.count_request()
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        server.delay()
+
+        if url.path.endswith("/verenigingen/mutaties"):
+            since = int(query.get("sinds", ["0"])[0])
+            return self.respond(200, [m for m in server.data.mutations if m["sequence"] > since])
+        if url.path.endswith("context.json"):
+            return self.respond_bytes(200, server.data.context)
+        if server.throttle():
+            return self.respond(429, {"status": 429, "title": "Too many requests"},
+                                {"Retry-After": str(server.retry_after)})
+        if url.path.endswith("/verenigingen/zoeken"):
+            return self.search(query)
+
+        match = self.detail_path.match(url.path)
+        if not match:
+            return self.respond(404, {"status": 404, "title": "Not found"})
+        v_code = match.group("v_code")
+        if v_code in server.data.removed:
+            return self.respond(404, REMOVED_RESOURCE_BODY)
+        if v_code not in server.data.details:
+            return self.respond(404, {"status": 404, "title": "Not found"})
+        etag, body = server.data.details[v_code]
+        if self.headers.get("If-None-Match") == etag:
+            return self.respond_bytes(304, b"", {"ETag": etag})
+        return self.respond_bytes(200, body, {"ETag": etag})
+
+    def do_POST(self):
+        self.server.count_request()
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.endswith("/v1/token"):
+            return self.respond(200, {"access_token": "stub-token", "token_type": "Bearer", "expires_in": 3600})
+        return self.respond(404, {"status": 404, "title": "Not found"})
+
+    def search(self, query):
+        postcode = query.get("q", [""])[0].split(":")[-1]
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", ["100"])[0])
+        v_codes = self.server.data.postcodes.get(postcode, [])
+        return self.respond(200, {
+            "verenigingen": [{"vCode": v_code} for v_code in v_codes[offset:offset + limit]],
+            "metadata": {"pagination": {"totalCount": len(v_codes), "offset": offset, "limit": limit}},
+        })
+
+    def respond(self, status, body, headers=None):
+        self.respond_bytes(status, json.dumps(body).encode("utf-8"), headers)
+
+    def respond_bytes(self, status, body, headers=None):
+        self.send_response(status)
+        if body:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RegisterStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, data, latency=0.0, error_rate=0.0, retry_after=0.1, seed=42):
+        super().__init__(address, RegisterStubHandler)
+        self.data = data
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def delay(self):
+        "Sleeps for a latency drawn uniformly around the configured mean"
+        if self.latency:
+            with self.lock:
+                latency = self.rng.uniform(0, 2 * self.latency)
+            time.sleep(latency)
+
+    def throttle(self):
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+
+def start_register_stub(data, host="127.0.0.1", port=0, **options):
+    """Starts the stand-in on a background thread, and returns the server. Port 0 picks a free port."""
+    server = RegisterStubServer((host, port), data, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_environment(server):
+    "Environment variables pointing the service at the stand-in"
+    return {
+        "API_URL": f"{server.url}/v1/",
+        "PUBLIC_API_BASE_VERENIGINGENREGISTER": server.url,
+        "CONTEXT_URL": f"{server.url}/v1/contexten/beheer/detail-vereniging-context.json",
+        "AUD": server.url,
+        "SCOPE": "dv_magda_organisaties_verenigingen_verenigingen_v1_read",
+        "AUTHORIZATION_KEY": "c3R1YjpzdHVi",
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument("--fixtures", help="Folder with recorded responses, instead of the synthetic corpus")
+    parser.add_argument("--size", type=int, default=10000, help="Number of synthetic verenigingen")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean latency of a response, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of register requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After of the 429 responses, in seconds")
+    parser.add_argument("--removed-rate", type=float, default=0.0, help="Fraction of verenigingen answering 404 as removed")
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def create_register_stub(args, host="127.0.0.1", port=0):
+    data = RegisterData.from_fixtures(args.fixtures) if args.fixtures else RegisterData.synthetic(args.size, args.seed)
+    data.remove_random(args.removed_rate, random.Random(args.seed))
+    return start_register_stub(data, host, port,
+                               latency=args.latency,
+                               error_rate=args.error_rate,
+                               retry_after=args.retry_after,
+                               seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = create_register_stub(args, args.host, args.port)
+    print(f"Serving {len(server.data.details)} verenigingen on {server.url}. Point the service at it with:")
+    for name, value in stub_environment(server).items():
+        print(f"  {name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,32 @@
+"""
+Micro-benchmark of lblod.transform_data on a synthetic corpus.
+
+    python -m benchmarks.transform_benchmark [--size 50000] [--runs 3]
+"""
+import argparse
+import time
+
+from benchmarks.corpus import make_corpus
+from lblod.transform_data import VerenigingTransformer, load_association_types
+
+
+def run(size, runs):
+    transformer = VerenigingTransformer(load_association_types())
+    timings = []
+    for _ in range(runs):
+        # The transformer works in place, so every run gets a fresh corpus.
+        corpus = make_corpus(size)
+        start = time.perf_counter()
+        transformed = transformer.transform_all(corpus)
+        timings.append(time.perf_counter() - start)
+        assert len(transformed) == size
+    best = min(timings)
+    print(f"transform_data: {size} items, best of {runs} runs: {best:.3f}s ({size / best:,.0f} items/sec)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=50000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    run(args.size, args.runs)
@@ -0,0 +1,53 @@
+"""
+Counts the uuid5 hashing calls made by transform_data on a synthetic corpus,
+with and without the memoised concept uuids.
+
+    python -m benchmarks.uuid_benchmark [--size 50000]
+"""
+import argparse
+import time
+import uuid
+
+from benchmarks.corpus import make_corpus
+from lblod import transform_data
+from lblod.transform_data import VerenigingTransformer, load_association_types
+
+calls = 0
+original_uuid5 = uuid.uuid5
+
+
+def counting_uuid5(namespace, name):
+    global calls
+    calls += 1
+    return original_uuid5(namespace, name)
+
+
+def measure(label, size):
+    global calls
+    transformer = VerenigingTransformer(load_association_types())
+    corpus = make_corpus(size)
+    calls = 0
+    start = time.perf_counter()
+    transformer.transform_all(corpus)
+    duration = time.perf_counter() - start
+    print(f"{label}: {calls} uuid5 calls for {size} items, {duration:.3f}s")
+
+
+def run(size):
+    uuid.uuid5 = counting_uuid5
+    try:
+        memoised = transform_data.location_type_uuid
+        transform_data.location_type_uuid = transform_data.create_uuid_from_string
+        measure("without memoisation", size)
+        transform_data.location_type_uuid = memoised
+        transform_data.create_concept_uuid.cache_clear()
+        measure("with memoisation", size)
+    finally:
+        uuid.uuid5 = original_uuid5
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=50000)
+    args = parser.parse_args()
+    run(args.size)
@@ -6,8 +6,32 @@ JOB_TYPE = "http://vocab.deri.ie/cogs#Job"
 TASK_TYPE = "http://redpencil.data.gift/vocabularies/tasks/Task"
 
 DEFAULT_GRAPH = os.environ.get('DEFAULT_GRAPH', None) or 'http://mu.semte.ch/graphs/public'
-MUTATIEDIENST_SYNC_INTERVAL_SECONDS = os.environ.get('MUTATIEDIENST_SYNC_INTERVAL_SECONDS', '*/5')
+MUTATIEDIENST_SYNC_MIN_INTERVAL_SECONDS = float(os.environ.get('MUTATIEDIENST_SYNC_MIN_INTERVAL_SECONDS', '5'))
+MUTATIEDIENST_SYNC_MAX_INTERVAL_SECONDS = float(os.environ.get('MUTATIEDIENST_SYNC_MAX_INTERVAL_SECONDS', '60'))
 MUTATIEDIENST_SYNC_INTERVAL_ACTIVITY_WINDOW = os.environ.get('MUTATIEDIENST_SYNC_INTERVAL_ACTIVITY_WINDOW', '7-20')
+MUTATIEDIENST_MAX_CHANGES_PER_JOB = int(os.environ.get('MUTATIEDIENST_MAX_CHANGES_PER_JOB', '1000'))
+MUTATIEDIENST_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('MUTATIEDIENST_CONNECT_TIMEOUT_SECONDS', '5'))
+MUTATIEDIENST_READ_TIMEOUT_SECONDS = float(os.environ.get('MUTATIEDIENST_READ_TIMEOUT_SECONDS', '60'))
+DETAIL_FETCH_CONCURRENCY = int(os.environ.get('DETAIL_FETCH_CONCURRENCY', '6'))
+POSTCODE_SEARCH_CONCURRENCY = int(os.environ.get('POSTCODE_SEARCH_CONCURRENCY', '6'))
+SEARCH_PAGE_CONCURRENCY = int(os.environ.get('SEARCH_PAGE_CONCURRENCY', '4'))
+REGISTER_MAX_REQUESTS_PER_SECOND = float(os.environ.get('REGISTER_MAX_REQUESTS_PER_SECOND', '0'))
+REGISTER_MAX_THROTTLE_RETRIES = int(os.environ.get('REGISTER_MAX_THROTTLE_RETRIES', '5'))
+TRANSFORM_PROCESSES = int(os.environ.get('TRANSFORM_PROCESSES', '0'))
+TRANSFORM_CHUNK_SIZE = int(os.environ.get('TRANSFORM_CHUNK_SIZE', '500'))
+FULL_SYNC_STREAMING = os.environ.get('FULL_SYNC_STREAMING', 'false').lower() in ['yes', 'on', 'true', '1']
+FULL_SYNC_CHECKPOINTING = os.environ.get('FULL_SYNC_CHECKPOINTING', 'false').lower() in ['yes', 'on', 'true', '1']
+CHECKPOINT_MAX_AGE_DAYS = float(os.environ.get('CHECKPOINT_MAX_AGE_DAYS', '7'))
+FULL_SYNC_OUTPUT_MODE = os.environ.get('FULL_SYNC_OUTPUT_MODE', 'full').lower()
+HASH_INDEX_PATH = os.environ.get('HASH_INDEX_PATH', None) or\
+    f"/share/{os.environ.get('MU_APPLICATION_FILE_STORAGE_PATH', '').rstrip('/')}/cache/hash-index.json"
+JSON_CODEC = os.environ.get('JSON_CODEC', 'auto').lower()
+OUTPUT_COMPRESSION_LEVEL = int(os.environ.get('OUTPUT_COMPRESSION_LEVEL', '9'))
+HARVEST_OUTPUT_FORMAT = os.environ.get('HARVEST_OUTPUT_FORMAT', 'json').lower()
+ETAG_STORE_ENABLED = os.environ.get('ETAG_STORE_ENABLED', 'true').lower() in ['yes', 'on', 'true', '1']
+ETAG_STORE_PATH = os.environ.get('ETAG_STORE_PATH', None) or\
+    f"/share/{os.environ.get('MU_APPLICATION_FILE_STORAGE_PATH', '').rstrip('/')}/cache/etag-store.sqlite"
+ETAG_STORE_MAX_SIZE_MB = float(os.environ.get('ETAG_STORE_MAX_SIZE_MB', '1024'))
 
 
 FILE_STATUSES =  {
@@ -51,4 +75,6 @@ PUBLIC_API_BASE_VERENIGINGENREGISTER = os.environ.get("PUBLIC_API_BASE_VERENIGIN
 
 MUTATIEDIENST_PATH = "/v1/verenigingen/mutaties"
 MUTATIEDIENST_URL = f"{PUBLIC_API_BASE_VERENIGINGENREGISTER}{MUTATIEDIENST_PATH}"
+CONTEXT_URL = os.environ.get("CONTEXT_URL", None) or\
+    "https://publiek.verenigingen.staging-vlaanderen.be/v1/contexten/beheer/detail-vereniging-context.json"
 API_URL = os.environ["API_URL"]
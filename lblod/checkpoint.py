@@ -0,0 +1,115 @@
+import os
+import json
+import shutil
+import time
+from helpers import logger
+from lblod.file import STORAGE_PATH
+
+CHECKPOINTS_PATH = os.path.join(STORAGE_PATH, "checkpoints")
+
+
+class Checkpoint:
+    """
+    On-disk progress of a full sync, so a task that died part-way can resume where it left off.
+    Lives in a directory per task under the share storage path, with:
+      - vcodes.txt: the vCodes found by the postcode searches, one per line
+      - vcodes.done: marker written once all searches have completed
+      - details.jsonl: the fetched detail bodies, one JSON object per line
+    Lines are flushed as they are written. A line cut off by a crash is ignored when loading.
+    """
+
+    def __init__(self, task_id):
+        self.path = os.path.join(CHECKPOINTS_PATH, task_id)
+        self.vcodes_path = os.path.join(self.path, "vcodes.txt")
+        self.vcodes_done_path = os.path.join(self.path, "vcodes.done")
+        self.details_path = os.path.join(self.path, "details.jsonl")
+        os.makedirs(self.path, exist_ok=True)
+        self.detail_offsets = self._index_details()
+        self.details_file = None
+        if self.detail_offsets:
+            logger.info(f"Resuming from checkpoint {self.path} with {len(self.detail_offsets)} fetched details")
+
+    @classmethod
+    def for_task(cls, task):
+        return cls(task["id"])
+
+    def _index_details(self):
+        offsets = {}
+        if not os.path.exists(self.details_path):
+            return offsets
+        with open(self.details_path, "rb") as file:
+            offset = 0
+            valid_until = 0
+            for line in file:
+                try:
+                    detail = json.loads(line)
+                    offsets[detail["vCode"]] = offset
+                    valid_until = offset + len(line)
+                except (ValueError, KeyError):
+                    break
+                offset += len(line)
+        # Drop whatever a crash left behind after the last complete line.
+        with open(self.details_path, "r+b") as file:
+            file.truncate(valid_until)
+        return offsets
+
+    def has_vcodes(self):
+        return os.path.exists(self.vcodes_done_path)
+
+    def load_vcodes(self):
+        with open(self.vcodes_path, "r") as file:
+            return [line.strip() for line in file if line.strip()]
+
+    def record_vcodes(self, vcodes):
+        """Passes the vCodes through, writing them to the checkpoint. Marks the list complete at the end."""
+        with open(self.vcodes_path, "w") as file:
+            for v_code in vcodes:
+                file.write(f"{v_code}\n")
+                file.flush()
+                yield v_code
+        with open(self.vcodes_done_path, "w") as file:
+            file.write("")
+
+    def has_detail(self, v_code):
+        return v_code in self.detail_offsets
+
+    def load_detail(self, v_code):
+        with open(self.details_path, "rb") as file:
+            file.seek(self.detail_offsets[v_code])
+            return json.loads(file.readline())
+
+    def record_detail(self, v_code, detail):
+        if v_code in self.detail_offsets:
+            return
+        if self.details_file is None:
+            self.details_file = open(self.details_path, "ab")
+        line = (json.dumps(detail) + "\n").encode("utf-8")
+        self.detail_offsets[v_code] = self.details_file.tell()
+        self.details_file.write(line)
+        self.details_file.flush()
+
+    def clear(self):
+        if self.details_file:
+            self.details_file.close()
+            self.details_file = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def remove_stale_checkpoints(max_age_days, keep=None):
+    """
+    Removes the checkpoints that haven't been written to for more than `max_age_days`, except the one of `keep`.
+    Checkpoints of tasks that succeeded are cleared right away, those of failed tasks would otherwise stay forever.
+    """
+    if not max_age_days or not os.path.isdir(CHECKPOINTS_PATH):
+        return
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+    for task_id in os.listdir(CHECKPOINTS_PATH):
+        path = os.path.join(CHECKPOINTS_PATH, task_id)
+        if task_id == keep or not os.path.isdir(path):
+            continue
+        # details.jsonl is appended to in place, so the directory's own mtime isn't enough
+        last_write = max([os.path.getmtime(path)] +
+                         [os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)])
+        if last_write < cutoff:
+            logger.info(f"Removing stale checkpoint {path}")
+            shutil.rmtree(path, ignore_errors=True)
@@ -1,131 +1,197 @@
 import requests
-import json
+from lblod import json_codec
 import os
 import concurrent.futures
+import queue
+import threading
 from lblod.helpers import get_access_token, get_context
+from lblod.http_client import authorized_get
+from lblod.rate_limiter import backoff_delay
+import time
 import uuid
 from helpers import logger
-from lblod.job import update_task_status
-from constants import TASK_STATUSES
+from lblod.job import mark_task_failed
+from constants import SEARCH_PAGE_CONCURRENCY, POSTCODE_SEARCH_CONCURRENCY, CONTEXT_URL
 
 api_url = os.environ["API_URL"]
 
 
-def fetch_data(access_token, postcode, limit=100):
+def fetch_search_page(url, headers, postcode, correlation_id, offset, limit):
+    max_retries = 5
+    paginated_url = url + f"&offset={offset}&limit={limit}"
+    logger.info(f"Paginated URL: {paginated_url}")
+
+    for attempt in range(max_retries):
+        try:
+            response = authorized_get(paginated_url, headers=headers, timeout=30)
+            response.raise_for_status()
+            return json_codec.response_json(response)
+
+        except requests.exceptions.Timeout as timeout_err:
+            logger.error(
+                f"Timeout error occurred for postcode {postcode} (attempt {attempt+1}/{max_retries}), correlation_id: {correlation_id}: {timeout_err}"
+            )
+            if attempt == max_retries - 1:
+                logger.error(
+                    f"Encountered exception while trying to fetch associations codes, correlation_id: {correlation_id}"
+                )
+                raise
+            sleep_time = backoff_delay(attempt)
+            logger.info(f"Retrying due to timeout in {sleep_time:.1f} seconds...")
+            time.sleep(sleep_time)
+        except (
+            requests.exceptions.HTTPError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.RequestException,
+        ) as req_err:
+            logger.error(
+                f"Request error occurred for postcode {postcode}, correlation_id: {correlation_id}: {req_err}"
+            )
+            raise
+        except Exception as e:
+            logger.error(
+                f"An unexpected error occurred for postcode {postcode}, correlation_id: {correlation_id}: {e}"
+            )
+            raise
+
+
+def fetch_data(postcode, limit=100, on_page=None):
+    """
+    Fetch the vCodes of all verenigingen with a location in the given postcode.
+    The first search page tells us the totalCount; the remaining pages are then
+    fetched concurrently, so large municipalities don't become a long serial tail.
+    `on_page` is called with the vCodes of every page, in page order.
+    """
     correlation_id = uuid.uuid4()
     logger.info(f"x-correlation-id: {correlation_id}")
     url = f"{api_url}verenigingen/zoeken?q=locaties.postcode:{postcode}"
     headers = {
-        "Authorization": f"Bearer {access_token}",
         "x-correlation-id": str(correlation_id),
     }
-    offset = 0
     v_codes = []
-    max_retries = 5
 
-    while True:
-        pagination_params = f"&offset={offset}&limit={limit}"
-        paginated_url = url + pagination_params
-        logger.info(f"Paginated URL: {paginated_url}")
+    def fetch_page(offset):
+        return fetch_search_page(url, headers, postcode, correlation_id, offset, limit)
 
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(paginated_url, headers=headers, timeout=30)
-                response.raise_for_status()
-
-                data = response.json()
-                v_codes.extend(
-                    [
-                        vereniging.get("vCode")
-                        for vereniging in data.get("verenigingen", [])
-                    ]
-                )
+    def handle_page(data):
+        page_v_codes = [
+            vereniging.get("vCode")
+            for vereniging in data.get("verenigingen", [])
+        ]
+        v_codes.extend(page_v_codes)
+        if on_page:
+            on_page(page_v_codes)
 
-                if data["metadata"]["pagination"]["totalCount"] > (offset + limit):
-                    offset += limit
-                    logger.info(f"Offset: {offset}")
-                else:
-                    return v_codes  # All data fetched, exit function
-                break  # Success, break out of retry loop
+    first_page = fetch_page(0)
+    handle_page(first_page)
 
-            except requests.exceptions.Timeout as timeout_err:
-                logger.error(
-                    f"Timeout error occurred for postcode {postcode} (attempt {attempt+1}/{max_retries}), correlation_id: {correlation_id}: {timeout_err}"
-                )
-                if attempt == max_retries - 1:
-                    logger.error(
-                        f"Encountered exception while trying to fetch associations codes, correlation_id: {correlation_id}"
-                    )
-                    raise
-                logger.info("Retrying due to timeout...")
-            except (
-                requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.RequestException,
-            ) as req_err:
-                logger.error(
-                    f"Request error occurred for postcode {postcode}, correlation_id: {correlation_id}: {req_err}"
-                )
-                raise
-            except Exception as e:
-                logger.error(
-                    f"An unexpected error occurred for postcode {postcode}, correlation_id: {correlation_id}: {e}"
-                )
-                raise
+    total_count = first_page["metadata"]["pagination"]["totalCount"]
+    offsets = list(range(limit, total_count, limit))
+    if offsets:
+        logger.info(f"Fetching {len(offsets)} remaining pages for postcode {postcode}")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=SEARCH_PAGE_CONCURRENCY) as executor:
+            for data in executor.map(fetch_page, offsets):
+                handle_page(data)
+
+    return v_codes
 
 
-def fetch_vcodes(task):
+def load_postal_codes():
     current_directory = os.path.dirname(os.path.realpath(__file__))
     json_file_path = os.path.join(current_directory, "postal_codes.json")
+    with open(json_file_path, "r") as file:
+        postal_codes_data = json_codec.load(file)
+        return (
+            postal_codes_data["postal_codes_brussels"]
+            + postal_codes_data["postal_codes_flanders"]
+        )
+
+
+class _SearchDone:
+    "Marks the end of the postcode searches on the vCode queue"
+    def __init__(self, error=None):
+        self.error = error
+
+
+def iter_vcodes(task, max_queued=1000):
+    """
+    Producer side of the full sync pipeline. The postcode searches run in the background
+    and push the vCodes of every search page onto a bounded queue, which this generator
+    drains. Detail fetching can therefore start as soon as the first page comes in,
+    instead of waiting for all searches to finish.
+    vCodes are yielded once, even when a vereniging has locations in several postcodes.
+    Errors of the searches are raised to the consumer, wrapped in a plain Exception.
+    """
     access_token = get_access_token()
+    if not access_token:
+        raise Exception("Failed to obtain access token")
+    logger.info("Access token: success")
 
-    if access_token:
-        logger.info("Access token: success")
+    belgium_postal_codes = load_postal_codes()
+    vcode_queue = queue.Queue(maxsize=max_queued)
+    stopped = threading.Event()
 
-        with open(json_file_path, "r") as file:
-            postal_codes_data = json.load(file)
-            belgium_postal_codes = (
-                postal_codes_data["postal_codes_brussels"]
-                + postal_codes_data["postal_codes_flanders"]
-            )
+    def put(item):
+        # Don't block forever on a full queue when the consumer has given up.
+        while not stopped.is_set():
+            try:
+                vcode_queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise Exception("vCode consumer stopped, aborting postcode search")
 
-        all_vcodes = []
+    def on_page(v_codes):
+        for v_code in v_codes:
+            put(v_code)
 
-        def fetch_vcodes_single(postcode):
-            logger.info(f"Postcode: {postcode}")
-            return fetch_data(access_token, postcode, 160)
+    def fetch_vcodes_single(postcode):
+        logger.info(f"Postcode: {postcode}")
+        return fetch_data(postcode, 160, on_page)
 
+    def produce():
         try:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
-                results = executor.map(fetch_vcodes_single, belgium_postal_codes)
-                for v_codes in results:
-                    all_vcodes.extend(v_codes)
-                return all_vcodes
+            with concurrent.futures.ThreadPoolExecutor(max_workers=POSTCODE_SEARCH_CONCURRENCY) as executor:
+                for _ in executor.map(fetch_vcodes_single, belgium_postal_codes):
+                    pass
+            put(_SearchDone())
         except Exception as e:
-            logger.error(f"Unexpected error while fetching vcodes: {e}")
-            update_task_status(task["uri"], TASK_STATUSES["FAILED"])
-            return None
-    else:
-        logger.error("Failed to obtain access token")
-        update_task_status(task["uri"], TASK_STATUSES["FAILED"])
-        return None
+            if not stopped.is_set():
+                logger.error(f"Unexpected error while fetching vcodes: {e}")
+                put(_SearchDone(e))
 
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
 
-def fetch_context(task):
-    # TODO: bring to environment variable.
-    context_url = "https://publiek.verenigingen.staging-vlaanderen.be/v1/contexten/beheer/detail-vereniging-context.json"
+    seen = set()
+    try:
+        while True:
+            item = vcode_queue.get()
+            if isinstance(item, _SearchDone):
+                if item.error:
+                    # Not re-raised as is: a KeyError from a malformed search page
+                    # must not pass for a configuration error downstream.
+                    raise Exception(f"Postcode search failed: {item.error!r}") from item.error
+                return
+            if item not in seen:
+                seen.add(item)
+                yield item
+    finally:
+        stopped.set()
 
+
+def fetch_context(task):
     try:
-        context = get_context(context_url)
+        context = get_context(CONTEXT_URL)
         if context is not None:
             logger.info("Context successfully fetched and updated.")
             return context
         else:
             logger.error("Failed to fetch context.")
-            update_task_status(task, TASK_STATUSES["FAILED"])
+            mark_task_failed(task["uri"])
             return None
 
     except Exception as e:
         logger.error(f"Unexpected error occurred while fetching context: {e}")
-        update_task_status(task, TASK_STATUSES["FAILED"])
+        mark_task_failed(task["uri"])
         return None
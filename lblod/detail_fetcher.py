@@ -1,36 +1,52 @@
 import requests
 import os
+from lblod import json_codec
 import concurrent.futures
-from lblod.helpers import get_access_token
+from collections import deque
+from lblod.http_client import authorized_get
+from lblod.rate_limiter import backoff_delay
 import uuid
 from helpers import logger
-from lblod.job import update_task_status
-from constants import TASK_STATUSES
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry # type: ignore
+from lblod.job import mark_task_failed
+from constants import DETAIL_FETCH_CONCURRENCY
 import time
 api_url = os.environ["API_URL"]
 
 
-def fetch_detail_url(access_token, v_code, task):
+def fetch_detail_url(v_code, task, etag_store=None, sequence=None):
+    """
+    Fetches the details of the given vCode. With an ETag store, the request is conditional, and it's
+    skipped altogether if the stored body is known to be up to date for the mutation `sequence`.
+    """
     url = f"{api_url}verenigingen/{v_code}"
     correlation_id = uuid.uuid4()
     headers = {
-        "Authorization": f"Bearer {access_token}",
         "x-correlation-id": str(correlation_id)
     }
     retry_attempts = 5
 
+    cached = etag_store.get(v_code) if etag_store else None
+    if cached:
+        if sequence is not None and cached[2] is not None and cached[2] >= sequence:
+            logger.info(f"Stored body is up to date for sequence {sequence}, reusing it for vCode: {v_code}")
+            return association_from_body(json_codec.loads(cached[1]), cached[0])
+        headers["If-None-Match"] = cached[0]
+
     for attempt in range(retry_attempts):
 
         try:
-            response = requests.get(url, headers=headers, timeout=30)
+            response = authorized_get(url, headers=headers, timeout=30)
             response.raise_for_status()
 
-            data = response.json()
-            etag = response.headers.get("etag")
+            not_modified = cached and response.status_code == 304
+            if not_modified:
+                logger.info(f"Not modified since last fetch, reusing stored body for vCode: {v_code}")
+                data = json_codec.loads(cached[1])
+                etag = response.headers.get("etag") or cached[0]
+            else:
+                data = json_codec.response_json(response)
+                etag = response.headers.get("etag")
             association = data.get("vereniging")
-            metadata = data.get("metadata")
 
             if etag is None:
                 message = f"""The association data response did not have an ETag.
@@ -38,10 +54,13 @@ def fetch_detail_url(access_token, v_code, task):
                 raise Exception(message)
 
             if association is not None:
-                association["etag"] = etag
-                association["metadata"] = metadata
+                if etag_store and not_modified:
+                    if sequence is not None:
+                        etag_store.touch(v_code, sequence)
+                elif etag_store:
+                    etag_store.put(v_code, etag, response.text, sequence)
                 logger.info(f"Successfully fetched data for vCode: {v_code}")
-                return association
+                return association_from_body(data, etag)
             else:
                 message = f"No association data found for vCode: {v_code}, correlation_id: {correlation_id}"
                 raise Exception(message)
@@ -57,6 +76,8 @@ def fetch_detail_url(access_token, v_code, task):
             fail_body = try_json_from_request_response(response) or {}
             if is_removed_resource_response(fail_body):
                 logger.warning(f"We've found a removed vCode {v_code}. Skipping.")
+                if etag_store:
+                    etag_store.remove(v_code)
                 # TODO: we need to revise the pipeline.
                 #   For now we created an adhoc object so we can work with this further down the line.
                 return { "type": 'RemovedResource', "vCode": v_code }
@@ -72,31 +93,70 @@ def fetch_detail_url(access_token, v_code, task):
             break
 
         logger.info(f"Retrying... ({attempt + 1}/{retry_attempts})")
-        sleep_time = 5
-        logger.info(f"Sleeping ${sleep_time} seconds")
+        sleep_time = backoff_delay(attempt)
+        logger.info(f"Sleeping {sleep_time:.1f} seconds")
         time.sleep(sleep_time)
 
     error_message = f"Encountered exception while trying to fetch details for vCode: {v_code}, correlation_id: {correlation_id}"
     logger.error(error_message)
     raise Exception(error_message)
 
-def fetch_detail_urls(all_vcodes, task):
+def association_from_body(data, etag):
+    association = data["vereniging"]
+    association["etag"] = etag
+    association["metadata"] = data.get("metadata")
+    return association
+
+def fetch_detail_urls(all_vcodes, task, etag_store=None, checkpoint=None):
     try:
-        access_token = get_access_token()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
-            results = list(
-                executor.map(lambda v_code: fetch_detail_url(access_token, v_code, task), all_vcodes)
-            )
+        results = list(iter_detail_urls(all_vcodes, task, etag_store=etag_store, checkpoint=checkpoint))
     except Exception as e:
         logger.error(f"Unexpected error while fetching association detail URLs: {e}")
-        update_task_status(task["uri"], TASK_STATUSES["FAILED"])
+        mark_task_failed(task["uri"])
         return None
 
     return results
 
+def iter_detail_urls(all_vcodes, task, max_pending=None, etag_store=None, checkpoint=None, sequences=None):
+    """
+    Fetch the details for the given vCodes and yield them in order, as soon as they
+    are available. At most `max_pending` results are kept in flight, so memory stays
+    bounded regardless of the number of vCodes.
+    With a checkpoint, details fetched by an earlier attempt are read back from disk
+    instead of being fetched again, and new ones are added to it.
+    `sequences` optionally maps vCodes to the sequence of their latest mutation, see fetch_detail_url.
+    Unlike fetch_detail_urls, errors are raised to the caller.
+    """
+    max_pending = max_pending or 4 * DETAIL_FETCH_CONCURRENCY
+    with concurrent.futures.ThreadPoolExecutor(max_workers=DETAIL_FETCH_CONCURRENCY) as executor:
+        pending = deque()
+
+        def next_result():
+            v_code, future = pending.popleft()
+            result = future.result()
+            if checkpoint:
+                checkpoint.record_detail(v_code, result)
+            return result
+
+        try:
+            for v_code in all_vcodes:
+                if checkpoint and checkpoint.has_detail(v_code):
+                    future = executor.submit(checkpoint.load_detail, v_code)
+                else:
+                    sequence = sequences.get(v_code) if sequences else None
+                    future = executor.submit(fetch_detail_url, v_code, task, etag_store, sequence)
+                pending.append((v_code, future))
+                if len(pending) >= max_pending:
+                    yield next_result()
+            while pending:
+                yield next_result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
 def try_json_from_request_response(response):
     try:
-        return response.json()
+        return json_codec.response_json(response)
     except:
         return None
 
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import threading
+import time
+from helpers import logger
+from constants import ETAG_STORE_ENABLED, ETAG_STORE_PATH, ETAG_STORE_MAX_SIZE_MB
+
+_store = None
+_store_lock = threading.Lock()
+
+# Once over its maximum size, the store is trimmed a bit further, so it doesn't evict on every put.
+EVICTION_TARGET_RATIO = 0.9
+EVICTION_BATCH_SIZE = 100
+# Resolution of the least recently used order
+LAST_ACCESS_GRANULARITY_SECONDS = 3600
+
+
+class EtagStore:
+    """
+    Size-bounded cache of the last fetched detail body of every vCode, keyed by vCode, together with its ETag.
+    This lets the full sync and the mutatiedienst send `If-None-Match` and reuse the stored body on a 304,
+    instead of downloading the same vereniging again.
+    Bodies fetched for a mutation also keep its sequence: a body is known to be up to date for
+    any mutation up to that sequence, and then doesn't need a request at all.
+    The least recently used bodies are evicted once the store grows over `max_size` bytes.
+    The connection is shared between the fetcher threads, access is serialised by a lock.
+    """
+
+    def __init__(self, path, max_size=None):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""
+              CREATE TABLE IF NOT EXISTS details (
+                vcode TEXT PRIMARY KEY,
+                etag TEXT NOT NULL,
+                body TEXT NOT NULL
+              )
+            """)
+            # Columns added later on, stores created before are migrated in place.
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(details)")]
+            if "sequence" not in columns:
+                self.connection.execute("ALTER TABLE details ADD COLUMN sequence INTEGER")
+            if "size" not in columns:
+                self.connection.execute("ALTER TABLE details ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+                self.connection.execute("UPDATE details SET size = length(body)")
+            if "last_access" not in columns:
+                self.connection.execute("ALTER TABLE details ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS details_last_access ON details (last_access)")
+            self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM details").fetchone()[0]
+
+    def get(self, v_code):
+        """
+        Returns (etag, body, sequence) for the given vCode, or None if unknown.
+        Reads only write back their access time when it's older than LAST_ACCESS_GRANULARITY_SECONDS,
+        so a full sync doesn't turn every lookup into a write.
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT etag, body, sequence, last_access FROM details WHERE vcode = ?", (v_code,)
+            ).fetchone()
+            if not row:
+                return None
+            now = time.time()
+            if now - row[3] > LAST_ACCESS_GRANULARITY_SECONDS:
+                self.connection.execute(
+                    "UPDATE details SET last_access = ? WHERE vcode = ?", (now, v_code)
+                )
+            return row[:3]
+
+    def put(self, v_code, etag, body, sequence=None):
+        """
+        Stores the body fetched for the given vCode.
+        Without a sequence, the one of the previous body is kept: the new body is at least as recent.
+        """
+        size = len(body)
+        with self.lock, self.connection:
+            previous = self.connection.execute(
+                "SELECT size FROM details WHERE vcode = ?", (v_code,)
+            ).fetchone()
+            self.connection.execute("""
+              INSERT INTO details (vcode, etag, body, sequence, size, last_access) VALUES (?, ?, ?, ?, ?, ?)
+              ON CONFLICT (vcode) DO UPDATE SET
+                etag = excluded.etag,
+                body = excluded.body,
+                sequence = COALESCE(excluded.sequence, details.sequence),
+                size = excluded.size,
+                last_access = excluded.last_access
+            """, (v_code, etag, body, sequence, size, time.time()))
+            self.size += size - (previous[0] if previous else 0)
+            self._evict()
+
+    def touch(self, v_code, sequence):
+        "Records that the stored body of the given vCode is up to date for the given sequence"
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE details SET sequence = MAX(COALESCE(sequence, ?), ?), last_access = ? WHERE vcode = ?",
+                (sequence, sequence, time.time(), v_code)
+            )
+
+    def remove(self, v_code):
+        with self.lock, self.connection:
+            previous = self.connection.execute(
+                "SELECT size FROM details WHERE vcode = ?", (v_code,)
+            ).fetchone()
+            if previous:
+                self.connection.execute("DELETE FROM details WHERE vcode = ?", (v_code,))
+                self.size -= previous[0]
+
+    def _evict(self):
+        "Drops the least recently used bodies until the store is back under its maximum size. Expects the lock."
+        if not self.max_size or self.size <= self.max_size:
+            return
+        target = self.max_size * EVICTION_TARGET_RATIO
+        evicted = 0
+        while self.size > target:
+            rows = self.connection.execute(
+                "SELECT vcode, size FROM details ORDER BY last_access LIMIT ?", (EVICTION_BATCH_SIZE,)
+            ).fetchall()
+            if not rows:
+                break
+            for v_code, size in rows:
+                if self.size <= target:
+                    break
+                self.connection.execute("DELETE FROM details WHERE vcode = ?", (v_code,))
+                self.size -= size
+                evicted += 1
+        logger.info(f"Evicted {evicted} bodies from the ETag store, {self.size} bytes left")
+
+
+def get_etag_store():
+    """Returns the shared ETag store, or None when it has been disabled."""
+    global _store
+    if not ETAG_STORE_ENABLED:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                logger.info(f"Using ETag store at {ETAG_STORE_PATH}, up to {ETAG_STORE_MAX_SIZE_MB} MB")
+                _store = EtagStore(ETAG_STORE_PATH, int(ETAG_STORE_MAX_SIZE_MB * 1024 * 1024))
+    return _store
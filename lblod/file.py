@@ -1,16 +1,23 @@
 import os
 import gzip
+import time
 from string import Template
 from datetime import datetime, timezone
 from escape_helpers import sparql_escape_uri, sparql_escape_string, sparql_escape_int, sparql_escape_datetime
-from constants import FILE_STATUSES, RESOURCE_BASE, PREFIXES, DEFAULT_GRAPH, JOB_CREATOR_URI
+from constants import FILE_STATUSES, RESOURCE_BASE, PREFIXES, DEFAULT_GRAPH, JOB_CREATOR_URI, \
+    OUTPUT_COMPRESSION_LEVEL
 from helpers import generate_uuid
 from sudo_query import update_sudo
+from lblod.gzip_writer import GzipWriter
 
 MU_APPLICATION_GRAPH = os.environ.get("MU_APPLICATION_GRAPH")
 RELATIVE_STORAGE_PATH = os.environ.get("MU_APPLICATION_FILE_STORAGE_PATH", "").rstrip("/")
 STORAGE_PATH = f"/share/{RELATIVE_STORAGE_PATH}"
 
+NDJSON_GZIP_FORMAT = "application/x-ndjson+gzip"
+# Records per gzip member in NDJSON output
+NDJSON_LINES_PER_MEMBER = 1000
+
 ############################################################
 # TODO: keep this generic and extract into packaged module later
 ############################################################
@@ -86,27 +93,86 @@ def file_to_shared_uri(file_name):
         return f"share://{file_name}"
 
 def save_json_on_disk(content, rdo = None):
+    return save_json_stream_on_disk([content], rdo)
+
+def save_json_stream_on_disk(chunks, rdo = None):
+    """
+    Write an iterable of string chunks to a gzipped JSON file, as they come in.
+    If the iterable raises, the partially written file is removed again.
+    """
+    def write(json_file_path):
+        with GzipWriter(json_file_path, OUTPUT_COMPRESSION_LEVEL) as f:
+            for chunk in chunks:
+                f.write(chunk.encode("utf-8"))
+        return f.uncompressed_size, f.compression_time
+
+    return save_file_on_disk(write, "json.gz", "application/gzip", rdo)
+
+def save_ndjson_stream_on_disk(lines, rdo = None, lines_per_member = NDJSON_LINES_PER_MEMBER):
+    """
+    Write an iterable of newline-terminated JSON records to a gzipped NDJSON file, as they come in.
+    Every `lines_per_member` records are compressed into a gzip member of their own: the file as a whole
+    is a regular gzip stream, but consumers can also split it at member boundaries and decompress in parallel.
+    If the iterable raises, the partially written file is removed again.
+    """
+    def write(ndjson_file_path):
+        uncompressed_size = 0
+        compression_time = 0.0
+        with open(ndjson_file_path, "wb") as f:
+            for member in iter_chunks(lines, lines_per_member):
+                data = "".join(member).encode("utf-8")
+                start = time.perf_counter()
+                f.write(gzip.compress(data, compresslevel=OUTPUT_COMPRESSION_LEVEL))
+                compression_time += time.perf_counter() - start
+                uncompressed_size += len(data)
+        return uncompressed_size, compression_time
+
+    return save_file_on_disk(write, "ndjson.gz", NDJSON_GZIP_FORMAT, rdo)
+
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def save_file_on_disk(write, extension, file_format, rdo = None):
+    """
+    Write a new file in the storage path through `write(path)`, and return its adapter.
+    `write` returns the uncompressed size and the time spent compressing, in seconds.
+    If writing fails, the partially written file is removed again.
+    """
     if not os.path.exists(STORAGE_PATH):
         os.mkdir(STORAGE_PATH)
 
     _uuid = generate_uuid()
-    json_file_name = f"{_uuid}.json.gz"
-    json_file_path = os.path.join(STORAGE_PATH, json_file_name)
+    file_name = f"{_uuid}.{extension}"
+    file_path = os.path.join(STORAGE_PATH, file_name)
 
-    with gzip.open(json_file_path, "wt", encoding="utf-8") as f:
-        f.write(content)
+    try:
+        uncompressed_size, compression_time = write(file_path)
+    except Exception:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
 
-    size = os.stat(json_file_path).st_size
+    size = os.stat(file_path).st_size
     file_created = datetime.now(timezone.utc)
 
     adapter = {}
     adapter["uuid"] = _uuid
     adapter["size"] = size
     adapter["file_created"] = file_created
-    adapter["extension"] = "json.gz"
-    adapter["format"] = "application/gzip"
-    adapter["physical_file_name"] = json_file_name
-    adapter["physical_file_path"] = json_file_path
+    adapter["extension"] = extension
+    adapter["format"] = file_format
+    adapter["physical_file_name"] = file_name
+    adapter["physical_file_path"] = file_path
+    adapter["uncompressed_size"] = uncompressed_size
+    adapter["compression_time"] = compression_time
+    adapter["compression_ratio"] = uncompressed_size / size if size else 0
     if(rdo):
         adapter["rdo"] = rdo
     return adapter
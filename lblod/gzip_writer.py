@@ -0,0 +1,31 @@
+import gzip
+import time
+
+
+class GzipWriter:
+    """
+    Writes bytes to a gzip file on the current thread.
+    Keeps track of the uncompressed size and of the time spent compressing.
+    """
+
+    def __init__(self, path, level=9):
+        self.file = gzip.open(path, "wb", compresslevel=level)
+        self.uncompressed_size = 0
+        self.compression_time = 0.0
+
+    def write(self, data):
+        start = time.perf_counter()
+        self.file.write(data)
+        self.uncompressed_size += len(data)
+        self.compression_time += time.perf_counter() - start
+
+    def close(self):
+        start = time.perf_counter()
+        self.file.close()
+        self.compression_time += time.perf_counter() - start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
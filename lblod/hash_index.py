@@ -0,0 +1,56 @@
+import os
+import json
+import hashlib
+from helpers import logger
+
+
+class HashIndex:
+    """
+    Content hashes of the transformed verenigingen of the last successful full sync, keyed by vCode.
+    Used by the delta-only output mode: while a new full sync runs, every vereniging is recorded
+    in a fresh index, and only the new or changed ones end up in the output.
+    The fresh index replaces the previous one on disk once commit is called, i.e. after the output
+    file has been stored. A failed run therefore leaves the previous index untouched.
+    """
+
+    def __init__(self, path, previous):
+        self.path = path
+        self.previous = previous
+        self.current = {}
+
+    @classmethod
+    def load(cls, path):
+        previous = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                previous = json.load(file)
+            logger.info(f"Loaded hash index with {len(previous)} entries from {path}")
+        else:
+            logger.info(f"No hash index found at {path}, every vereniging will be considered new")
+        return cls(path, previous)
+
+    @staticmethod
+    def hash_vereniging(vereniging):
+        serialized = json.dumps(vereniging, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+    def record(self, vereniging):
+        "Records the vereniging in the new index. Returns True if it is new or changed."
+        v_code = vereniging.get("vCode", "")
+        content_hash = self.hash_vereniging(vereniging)
+        self.current[v_code] = content_hash
+        return self.previous.get(v_code) != content_hash
+
+    def removed_vcodes(self):
+        "vCodes of the previous run that haven't been recorded in this run"
+        return sorted(v_code for v_code in self.previous if v_code not in self.current)
+
+    def commit(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.current, file)
+        os.replace(tmp_path, self.path)
+        logger.info(f"Stored hash index with {len(self.current)} entries at {self.path}")
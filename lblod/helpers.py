@@ -4,12 +4,84 @@ import jwt
 from datetime import datetime, timedelta
 import uuid
 import subprocess
-import json
 import glob
+import threading
+import time
+from cryptography.hazmat.primitives import serialization
 from helpers import logger
-from constants import MUTATIEDIENST_URL
+from lblod import json_codec
+from constants import MUTATIEDIENST_URL, MUTATIEDIENST_MAX_CHANGES_PER_JOB, \
+    MUTATIEDIENST_CONNECT_TIMEOUT_SECONDS, MUTATIEDIENST_READ_TIMEOUT_SECONDS
+
+# Renew the token this long before it expires, so it never runs out mid-request.
+TOKEN_REFRESH_MARGIN_SECONDS = 60
+# Used when the token endpoint doesn't tell us how long the token lives.
+DEFAULT_TOKEN_LIFETIME_SECONDS = 300
+
+_token_lock = threading.Lock()
+_cached_token = None
+_private_key = None
+
 
 def get_access_token():
+    """
+    Returns an access token for the verenigingenregister.
+    The token is cached in-process and only requested again shortly before it expires,
+    so frequent callers (e.g. the mutatiedienst ticks) don't sign a JWT and call the
+    token endpoint every time. Safe to call from several threads.
+    """
+    global _cached_token
+    with _token_lock:
+        if _cached_token and time.monotonic() < _cached_token["refresh_at"]:
+            return _cached_token["access_token"]
+
+        response = request_access_token()
+        if not response or not response.get("access_token"):
+            return None
+
+        expires_in = int(response.get("expires_in") or DEFAULT_TOKEN_LIFETIME_SECONDS)
+        _cached_token = {
+            "access_token": response["access_token"],
+            "refresh_at": time.monotonic() + max(expires_in - TOKEN_REFRESH_MARGIN_SECONDS, 0)
+        }
+        logger.info(f"Obtained new access token, valid for {expires_in} seconds")
+        return _cached_token["access_token"]
+
+
+def invalidate_access_token(rejected_token):
+    """
+    Drops the cached token after the register rejected it, so the next call to
+    get_access_token requests a new one. A token that has already been replaced
+    by another thread is left alone.
+    """
+    global _cached_token
+    with _token_lock:
+        if _cached_token and _cached_token["access_token"] == rejected_token:
+            _cached_token = None
+
+
+def load_private_key():
+    """Reads and parses the first .pem file in /config, once."""
+    global _private_key
+    if _private_key is None:
+        config_path = '/config'
+        if os.path.exists(config_path):
+            pem_files = glob.glob(os.path.join(config_path, '*.pem'))
+
+            if pem_files:
+                first_pem_file = pem_files[0]
+                with open(first_pem_file, 'rb') as file:
+                    _private_key = serialization.load_pem_private_key(file.read(), password=None)
+                print("First .pem file read successfully.")
+            else:
+                print("No .pem files found in the directory.")
+        else:
+            print(f"Directory '{config_path}' does not exist.")
+    return _private_key
+
+
+def request_access_token():
+    """Requests a new token from the token endpoint. Returns the parsed token response."""
     # required
     aud = os.environ["AUD"]
     scope = os.environ["SCOPE"]
@@ -29,7 +101,7 @@ def get_access_token():
 
         response = requests.post(url, headers=headers, data=data)
         if response.status_code == 200:
-            return response.json().get("access_token")
+            return json_codec.response_json(response)
         else:
             print("Error:", response.status_code)
             return None
@@ -45,22 +117,10 @@ def get_access_token():
             "jti": str(uuid.uuid4()),
             "iat": int(iat.timestamp())
         }
-        config_path = '/config'
-        if os.path.exists(config_path):
-            pem_files = glob.glob(os.path.join(config_path, '*.pem'))
+        private_key = load_private_key()
 
-            if pem_files:
-                first_pem_file = pem_files[0]
-                with open(first_pem_file, 'r') as file:
-                    key_test = file.read()
-                print("First .pem file read successfully.")
-            else:
-                print("No .pem files found in the directory.")
-        else:
-            print(f"Directory '{config_path}' does not exist.")
-
-        if(key_test):
-            token = jwt.encode(payload, key_test, algorithm="RS256")
+        if(private_key):
+            token = jwt.encode(payload, private_key, algorithm="RS256")
 
             curl_command = [
                 "curl", "-v", "-X", "POST", f"https://{host}/op/v1/token",
@@ -74,8 +134,8 @@ def get_access_token():
             curl_request_str = ' '.join(curl_command)
             print("\nCurl request:\n", curl_request_str)
             result = subprocess.run(curl_command, capture_output=True, text=True)
-            access_token = json.loads(result.stdout)['access_token']
-            return access_token
+            return json_codec.loads(result.stdout)
+        return None
 
 
 def get_context(url):
@@ -83,7 +143,7 @@ def get_context(url):
         response = requests.get(url, timeout=30)
         response.raise_for_status()
 
-        context = response.json()
+        context = json_codec.response_json(response)
         context.update({
             "doel": "https://data.vlaanderen.be/ns/",
             "loc": "http://data.lblod.info/id/vestigingen/",
@@ -125,11 +185,42 @@ def get_context(url):
 def fetch_data_mutatiedienst(since=0):
     try:
         target_url = f"{MUTATIEDIENST_URL}?sinds={since}"
-        response = requests.get(target_url)
+        # A hung connection would otherwise block the scheduler's chain of runs for good
+        response = requests.get(target_url,
+                                timeout=(MUTATIEDIENST_CONNECT_TIMEOUT_SECONDS, MUTATIEDIENST_READ_TIMEOUT_SECONDS))
         response.raise_for_status()
-        changes_json = response.json()
+        changes_json = json_codec.response_json(response)
         return changes_json
-    except HTTPError as http_err:
+    except requests.exceptions.HTTPError as http_err:
         logger.error(f"HTTP error occurred: {http_err}")
     except Exception as err:
         logger.error(f"Other error occurred: {err}")
+
+def fetch_mutatiedienst_window(since=0, limit=MUTATIEDIENST_MAX_CHANGES_PER_JOB):
+    """
+    Fetches the changes after `since`, capped at the `limit` oldest ones (0 means no cap).
+    Returns (changes, has_more), where changes is None if the mutatiedienst couldn't be reached.
+    The mutatiedienst isn't paged, so the window is cut here: the remaining changes
+    are picked up by the next job, which starts from the last sequence of this window.
+    """
+    changes = fetch_data_mutatiedienst(since)
+    if not changes:
+        return changes, False
+    changes = sorted(changes, key=lambda item: item["sequence"])
+    if limit and len(changes) > limit:
+        return changes[:limit], True
+    return changes, False
+
+def fetch_latest_sequence(since=0):
+    """
+    Returns the latest sequence of the mutatiedienst, or `since` if nothing changed after it,
+    or None if the mutatiedienst couldn't be reached.
+    Pass the last known sequence as `since`: only the changes after it are downloaded,
+    instead of the whole history of the register.
+    """
+    changes = fetch_data_mutatiedienst(since)
+    if changes is None:
+        return None
+    if not changes:
+        return int(since)
+    return max(item["sequence"] for item in changes)
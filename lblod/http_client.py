@@ -0,0 +1,88 @@
+import threading
+import time
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from helpers import logger
+from lblod.helpers import get_access_token, invalidate_access_token
+from lblod.rate_limiter import AdaptiveRateLimiter, backoff_delay, parse_retry_after
+from constants import DETAIL_FETCH_CONCURRENCY, SEARCH_PAGE_CONCURRENCY, POSTCODE_SEARCH_CONCURRENCY, \
+    REGISTER_MAX_REQUESTS_PER_SECOND, REGISTER_MAX_THROTTLE_RETRIES
+
+# The full sync runs several postcode searches at a time, each fanning out its pages.
+POOL_SIZE = DETAIL_FETCH_CONCURRENCY + POSTCODE_SEARCH_CONCURRENCY * SEARCH_PAGE_CONCURRENCY
+
+_session = None
+_session_lock = threading.Lock()
+_rate_limiters = {}
+
+
+def get_session():
+    """
+    Returns the requests session shared by all calls to the verenigingenregister.
+    Connections are kept alive and pooled, so the many detail calls of a full sync
+    reuse a handful of TCP/TLS connections instead of opening one per request.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4,
+                                      pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_rate_limiter(url):
+    """Returns the rate limiter shared by all requests to the host of the given url."""
+    host = urlparse(url).netloc
+    with _session_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = AdaptiveRateLimiter(host,
+                                                       rate=REGISTER_MAX_REQUESTS_PER_SECOND,
+                                                       burst=REGISTER_MAX_REQUESTS_PER_SECOND,
+                                                       max_concurrency=POOL_SIZE)
+        return _rate_limiters[host]
+
+
+def limited_get(url, **kwargs):
+    """
+    GET through the shared session, within the rate limits of the host.
+    A 429 lowers the allowed concurrency for the host and is retried after its
+    Retry-After (or a jittered exponential backoff), up to REGISTER_MAX_THROTTLE_RETRIES times.
+    """
+    rate_limiter = get_rate_limiter(url)
+    for attempt in range(REGISTER_MAX_THROTTLE_RETRIES + 1):
+        with rate_limiter.slot() as state:
+            response = get_session().get(url, **kwargs)
+            if response.status_code == 429:
+                state["throttled"] = True
+                state["retry_after"] = parse_retry_after(response.headers.get("Retry-After"))
+        if response.status_code != 429 or attempt == REGISTER_MAX_THROTTLE_RETRIES:
+            return response
+        delay = state["retry_after"] or backoff_delay(attempt)
+        logger.warning(f"Throttled on {url}, retrying in {delay:.1f} seconds ({attempt + 1}/{REGISTER_MAX_THROTTLE_RETRIES})")
+        time.sleep(delay)
+
+
+def authorized_get(url, headers=None, **kwargs):
+    """
+    GET on the verenigingenregister with a bearer token from get_access_token.
+    The token is looked up for every request, so long running harvests pick up renewed
+    tokens transparently. If the register still answers 401, the token is dropped and
+    the request is retried once with a fresh one.
+    """
+    for attempt in range(2):
+        access_token = get_access_token()
+        if not access_token:
+            raise Exception("Failed to obtain access token")
+        response = limited_get(url,
+                               headers={**(headers or {}), "Authorization": f"Bearer {access_token}"},
+                               **kwargs)
+        if response.status_code != 401 or attempt:
+            return response
+        logger.warning(f"Access token rejected for {url}, retrying with a new token")
+        invalidate_access_token(access_token)
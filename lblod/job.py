@@ -2,7 +2,7 @@ import os
 from datetime import datetime, timezone
 from string import Template
 
-from helpers import generate_uuid
+from helpers import generate_uuid, logger
 from escape_helpers import sparql_escape_uri, sparql_escape_datetime, sparql_escape_string, sparql_escape_int
 from sudo_query import auth_update_sudo, update_sudo, query_sudo
 
@@ -103,6 +103,16 @@ def update_task_status (task, status, graph=DEFAULT_GRAPH):
     )
     update_sudo(query_string)
 
+def mark_task_failed(task):
+    """
+    Sets the task to FAILED from an error path. Never raises: a triplestore error here
+    would replace the error being handled, so it's logged instead.
+    """
+    try:
+        update_task_status(task, TASK_STATUSES["FAILED"])
+    except Exception as e:
+        logger.error(f"Could not mark task {task} as FAILED: {e}")
+
 def create_job(job_operation_uri):
     """
     Creates a new job in the specified graph.
@@ -157,10 +167,9 @@ def create_task(job_uri, task_operation_uri, task_index="0"):
     return task_uri
 
 
-def any_other_harvest_jobs_running():
-    query_string = f"""
-      {PREFIXES}
-      ASK {{
+def harvest_jobs_running_pattern():
+    """Graph pattern matching harvest jobs (full or incremental) that are busy or scheduled."""
+    return f"""
         VALUES ?operation {{
          {sparql_escape_uri(OPERATIONS['FULL_HARVEST_JOB'])}
          {sparql_escape_uri(OPERATIONS['INCREMENTAL_COLLECTING'])}
@@ -172,8 +181,15 @@ def any_other_harvest_jobs_running():
         ?s a cogs:Job;
           task:operation ?operation;
           adms:status ?status .
+    """
+
+
+def any_other_harvest_jobs_running():
+    query_string = f"""
+      {PREFIXES}
+      ASK {{
+        {harvest_jobs_running_pattern()}
       }}
     """
     result = query_sudo(query_string)
     return result["boolean"]
-
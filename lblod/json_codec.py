@@ -0,0 +1,67 @@
+import json
+from helpers import logger
+from constants import JSON_CODEC
+
+# Backends by order of preference. All of them decode to the same Python objects,
+# but the encoded text can differ in whitespace and escaping: it's the same JSON document.
+BACKENDS = ["orjson", "ujson", "json"]
+
+
+def _stdlib_codec():
+    return json.loads, json.dumps
+
+
+def _orjson_codec():
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+
+    return orjson.loads, dumps
+
+
+def _ujson_codec():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+    return ujson.loads, dumps
+
+
+CODECS = {
+    "orjson": _orjson_codec,
+    "ujson": _ujson_codec,
+    "json": _stdlib_codec,
+}
+
+
+def load_codec(name="auto"):
+    """
+    Returns (backend, loads, dumps) for the given backend name, or the fastest installed one for `auto`.
+    `loads` accepts str and bytes, `dumps` returns a str.
+    """
+    candidates = BACKENDS if name == "auto" else [name]
+    for candidate in candidates:
+        if candidate not in CODECS:
+            raise ValueError(f"Unknown JSON codec: {candidate}. Expected one of auto, {', '.join(BACKENDS)}")
+        try:
+            loads, dumps = CODECS[candidate]()
+            return candidate, loads, dumps
+        except ImportError:
+            if name != "auto":
+                logger.warning(f"JSON codec {candidate} is not installed, falling back to the standard library")
+    return ("json",) + _stdlib_codec()
+
+
+backend, loads, dumps = load_codec(JSON_CODEC)
+logger.info(f"Using JSON codec: {backend}")
+
+
+def load(file):
+    return loads(file.read())
+
+
+def response_json(response):
+    """Drop-in for requests' `response.json()`, parsing the raw body with the selected codec."""
+    return loads(response.content)
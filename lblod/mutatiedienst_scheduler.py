@@ -1,39 +1,95 @@
 import os
 from helpers import logger
-from lblod.helpers import fetch_data_mutatiedienst
-from sudo_query import query_sudo
-from lblod.job import create_job, create_task, load_task, update_task_status, any_other_harvest_jobs_running
-from lblod.detail_fetcher import fetch_detail_urls
-from constants import OPERATIONS, MUTATIEDIENST_URL, TASK_STATUSES
-from lblod.pipeline import process_task
+from lblod.helpers import fetch_mutatiedienst_window
+from sudo_query import query_sudo, update_batch
+from lblod.job import create_job, create_task, update_task_status, harvest_jobs_running_pattern
+from lblod.detail_fetcher import iter_detail_urls
+from lblod.etag_store import get_etag_store
+from constants import OPERATIONS, MUTATIEDIENST_URL, TASK_STATUSES, PREFIXES, HARVEST_OUTPUT_FORMAT
+from lblod.pipeline import process_task, stream_task_ndjson
 from lblod.harvester import create_results_container
-from lblod.file import save_json_on_disk, save_json_file_in_triplestore
+from lblod.file import save_json_on_disk, save_ndjson_stream_on_disk, save_json_file_in_triplestore
 
-def fetch_last_successful_sequence_number():
-    query_string = """
-      SELECT DISTINCT ?subject ?since WHERE {
+# Outcomes of a run of the mutatiedienst pipeline, used to adapt the polling interval
+RUN_IDLE = "idle"  # nothing changed
+RUN_WAITING = "waiting"  # other jobs are running, changes may be waiting for them
+RUN_CHANGES = "changes"  # a batch of changes has been collected
+RUN_BACKLOG = "backlog"  # a full window of changes has been collected, more are waiting
+
+# Last sequence data read from the triplestore. Cached so idle ticks don't need to query it,
+# invalidated whenever we produce data that will move the stored sequence.
+_cached_sequence_data = None
+
+
+def invalidate_sequence_cache():
+    global _cached_sequence_data
+    _cached_sequence_data = None
+
+
+def fetch_mutatiedienst_state():
+    """
+    Fetches, in one query, whether other harvest jobs are running and the last sequence
+    number that has been successfully ingested.
+    """
+    query_string = f"""
+      {PREFIXES}
+      SELECT DISTINCT ?subject ?since ?otherJobsRunning WHERE {{
+        OPTIONAL {{
          ?subject a <http://data.lblod.info/vocabularies/FeitelijkeVerenigingen/MutatiedienstStateInfo>;
            <http://data.lblod.info/vocabularies/FeitelijkeVerenigingen/lastSequenceMutatiedienst> ?since.
-      }
+        }}
+        BIND(EXISTS {{
+          {harvest_jobs_running_pattern()}
+        }} AS ?otherJobsRunning)
+      }}
     """
     result = query_sudo(query_string)
-    if len(result["results"]["bindings"]) <= 1:
-        if len(result["results"]["bindings"]) == 0:
-            return None
-        else:
-          return {
-              "since": result["results"]["bindings"][0]["since"]["value"],
-              "subject": result["results"]["bindings"][0]["subject"]["value"]
-          }
-    else:
-        raise Exception(f"Too many sequence numbers stored in database: {len(result['results']['bindings'])}")
+    bindings = [binding for binding in result["results"]["bindings"] if "since" in binding]
+    other_jobs_running = any(
+        binding.get("otherJobsRunning", {}).get("value") in ["true", "1"]
+        for binding in result["results"]["bindings"]
+    )
+    if len(bindings) > 1:
+        raise Exception(f"Too many sequence numbers stored in database: {len(bindings)}")
+    sequence_data = None
+    if bindings:
+        sequence_data = {
+            "since": bindings[0]["since"]["value"],
+            "subject": bindings[0]["subject"]["value"]
+        }
+    return other_jobs_running, sequence_data
+
+
+def fold_mutations(mutatiedienst_changes):
+    """
+    Folds the mutations into the latest sequence per vCode,
+    so a vereniging that changed several times is only fetched once.
+    """
+    latest_sequences = {}
+    for item in mutatiedienst_changes:
+        v_code = item["vCode"]
+        latest_sequences[v_code] = max(item["sequence"], latest_sequences.get(v_code, item["sequence"]))
+    return latest_sequences
+
 
 def run_mutatiedienst_pipeline():
-    if(any_other_harvest_jobs_running()):
-        logger.warning(f"Other jobs are running that might affect the mutatiedienst job. Skipping...")
-        return
+    global _cached_sequence_data
+
+    # With a known sequence, ask the mutatiedienst first: most ticks find nothing,
+    # and then don't need the triplestore at all.
+    cached_sequence_data = _cached_sequence_data
+    if cached_sequence_data:
+        mutatiedienst_changes, has_more = fetch_mutatiedienst_window(cached_sequence_data["since"])
+        if not mutatiedienst_changes:
+            logger.info(f"No changes found since: {cached_sequence_data['since']}. Skipping")
+            return RUN_IDLE
+
+    other_jobs_running, sequence_data = fetch_mutatiedienst_state()
 
-    sequence_data = fetch_last_successful_sequence_number()
+    if other_jobs_running:
+        logger.warning(f"Other jobs are running that might affect the mutatiedienst job. Skipping...")
+        invalidate_sequence_cache()
+        return RUN_WAITING
 
     if not sequence_data:
         logger.info(f"""
@@ -41,39 +97,81 @@ def run_mutatiedienst_pipeline():
           This means an initial full sync hasn't started yet.
           Skipping iteration.
         """)
-        return
+        invalidate_sequence_cache()
+        return RUN_IDLE
 
-    mutatiedienst_changes = fetch_data_mutatiedienst(sequence_data["since"])
+    _cached_sequence_data = sequence_data
+    if not cached_sequence_data or cached_sequence_data["since"] != sequence_data["since"]:
+        mutatiedienst_changes, has_more = fetch_mutatiedienst_window(sequence_data["since"])
 
     # Assumes there is one job at the time!
-    if len(mutatiedienst_changes) == 0:
+    if not mutatiedienst_changes:
         logger.info(f"No changes found since: {sequence_data['since']}. Skipping")
-        return
-
-    last_sequence = mutatiedienst_changes[-1]["sequence"] # Assumes it's a sorted list
-
-    # TODO: assume this is a set, and mutatiedienst does the hard work for you in folding themselves
-    vCodes = { item["vCode"] for item in mutatiedienst_changes }
-
-    job_uri = create_job(OPERATIONS["INCREMENTAL_COLLECTING"])
-    task_uri = create_task(job_uri, OPERATIONS["INCREMENTAL_COLLECTING_TASK_OPERATION"])
-
-    try:
-        task = load_task(task_uri)
-        json_data = process_task(task, vCodes, MUTATIEDIENST_URL,
-                                 { "@id": sequence_data["subject"],
-                                   "lastSequenceMutatiedienst": last_sequence
-                                  })
-        json_file_data = save_json_on_disk(json_data)
-        json_file_uri = save_json_file_in_triplestore(json_file_data)
-        data_container_uri = create_results_container(task_uri, logical_json_file_uri = json_file_uri)
-
-        update_task_status(task["uri"], TASK_STATUSES["SUCCESS"])
-
-    except Exception as err:
-        # TODO: store error
-        logger.error(f"An error occured during the execution of mutatiedienst pipeline.")
-        logger.error(f"TASK: {task_uri}")
-        logger.error(f"ERROR: {err}")
-        update_task_status(task_uri, TASK_STATUSES["FAILED"])
-        raise err
+        return RUN_IDLE
+
+    latest_sequences = fold_mutations(mutatiedienst_changes)
+    last_sequence = max(latest_sequences.values())
+    vCodes = list(latest_sequences)
+    logger.info(f"Found {len(mutatiedienst_changes)} changes for {len(vCodes)} verenigingen, up to sequence {last_sequence}")
+    if has_more:
+        logger.info(f"More changes are waiting after sequence {last_sequence}, they are left for the next job")
+
+    # Details are fetched before any job or task is created: if the register fails us,
+    # there's nothing to clean up and the same changes are picked up by the next run.
+    details = list(iter_detail_urls(vCodes, None, etag_store=get_etag_store(), sequences=latest_sequences))
+
+    # The stored sequence moves once the data produced below has been imported.
+    invalidate_sequence_cache()
+
+    # All bookkeeping of this run is written in one round-trip, when the batch closes.
+    with update_batch():
+        job_uri = create_job(OPERATIONS["INCREMENTAL_COLLECTING"])
+        task_uri = create_task(job_uri, OPERATIONS["INCREMENTAL_COLLECTING_TASK_OPERATION"])
+
+        try:
+            # The task isn't in the triplestore until the batch is flushed, so it can't be loaded.
+            task = { "uri": task_uri }
+            sequence = { "@id": sequence_data["subject"], "lastSequenceMutatiedienst": last_sequence }
+            if HARVEST_OUTPUT_FORMAT == "ndjson":
+                lines = stream_task_ndjson(task, vCodes, MUTATIEDIENST_URL, sequence, details=details)
+                json_file_data = save_ndjson_stream_on_disk(lines)
+            else:
+                json_data = process_task(task, vCodes, MUTATIEDIENST_URL, sequence, details=details)
+                json_file_data = save_json_on_disk(json_data)
+            json_file_uri = save_json_file_in_triplestore(json_file_data)
+            data_container_uri = create_results_container(task_uri, logical_json_file_uri = json_file_uri)
+
+            update_task_status(task["uri"], TASK_STATUSES["SUCCESS"])
+
+        except Exception as err:
+            # TODO: store error
+            logger.error(f"An error occured during the execution of mutatiedienst pipeline.")
+            logger.error(f"TASK: {task_uri}")
+            logger.error(f"ERROR: {err}")
+            update_task_status(task_uri, TASK_STATUSES["FAILED"])
+            raise err
+
+    return RUN_BACKLOG if has_more else RUN_CHANGES
+
+
+class AdaptiveInterval:
+    """
+    Polling interval of the mutatiedienst, adapted to the outcome of every run.
+    It backs off (multiplying by `factor`, up to `maximum`) while runs find nothing,
+    and drops back to `minimum` as soon as changes come in, or are waiting for other jobs to finish.
+    A backlog is drained at `minimum` as well: the next job can only start once this one has been imported.
+    """
+
+    def __init__(self, minimum, maximum, factor=2):
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.factor = factor
+        self.current = minimum
+
+    def next(self, outcome):
+        "Returns the delay in seconds before the next run"
+        if outcome in [RUN_CHANGES, RUN_BACKLOG, RUN_WAITING]:
+            self.current = self.minimum
+        else:
+            self.current = min(self.maximum, self.current * self.factor)
+        return self.current
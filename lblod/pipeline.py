@@ -1,4 +1,4 @@
-import json
+from lblod import json_codec
 import datetime
 import os
 import uuid
@@ -8,19 +8,22 @@ from constants import DEFAULT_GRAPH, TASK_STATUSES, MUTATIEDIENST_URL, API_URL
 
 from lblod.file import STORAGE_PATH, construct_insert_file_query
 from lblod.harvester import collection_has_collected_files, create_results_container
-from lblod.job import update_task_status
+from lblod.job import update_task_status, mark_task_failed
 from sudo_query import update_sudo
 from helpers import logger
-from lblod.data_fetcher import fetch_vcodes, fetch_context
-from lblod.detail_fetcher import fetch_detail_urls
-from lblod.transform_data import transform_data
-import json
+from lblod.data_fetcher import fetch_context
+from lblod.detail_fetcher import fetch_detail_urls, iter_detail_urls
+from lblod.transform_data import transform_data, iter_transform_data
 
-def process_task(task, vcodes, api_url = API_URL, last_sequence = None):
+def process_task(task, vcodes, api_url = API_URL, last_sequence = None, etag_store = None, hash_index = None, checkpoint = None, details = None):
+    """
+    Fetch and transform the given vCodes into a JSON-LD document (as string).
+    When a hash_index is given, only new or changed verenigingen are written,
+    and the ones that disappeared since the previous run are listed under `removedVCodes`.
+    Details fetched up front by the caller can be passed as `details`, they are not fetched again.
+    """
     try:
-        if not vcodes:
-            raise ValueError("No vCodes found for the given postal codes.")
-        data = fetch_detail_urls(vcodes, task)
+        data = details if details is not None else fetch_detail_urls(vcodes, task, etag_store, checkpoint)
         if not data:
             raise ValueError("No data fetched for the provided vCodes.")
         context = fetch_context(task)
@@ -29,6 +32,8 @@ def process_task(task, vcodes, api_url = API_URL, last_sequence = None):
         transformed_data = transform_data(data)
         if not transformed_data:
             raise ValueError("No transformed data available.")
+        if hash_index:
+            transformed_data = [vereniging for vereniging in transformed_data if hash_index.record(vereniging)]
         all_data = {
             "@context": context,
             "verenigingen": transformed_data,
@@ -36,15 +41,97 @@ def process_task(task, vcodes, api_url = API_URL, last_sequence = None):
         }
         if last_sequence:
             all_data["sequence"] = last_sequence
-        return json.dumps(all_data)
+        if hash_index:
+            all_data["removedVCodes"] = hash_index.removed_vcodes()
+        return json_codec.dumps(all_data)
     except KeyError as e:
         logger.error(f"Missing environment variable: {e}")
         raise
     except Exception as e:
-        update_task_status(task["uri"], TASK_STATUSES["FAILED"])
+        mark_task_failed(task["uri"])
         logger.error(f"Error in process_task: {e}")
         raise
 
+def stream_task(task, vcodes, api_url = API_URL, last_sequence = None, etag_store = None, hash_index = None, checkpoint = None, details = None):
+    """
+    Streaming counterpart of process_task. Yields the same JSON document in chunks,
+    fetching and transforming one vereniging at a time, so the full harvest never
+    has to be held in memory. Meant to be consumed by save_json_stream_on_disk.
+    """
+    chunks = _json_chunks(task, vcodes, api_url, last_sequence, etag_store, hash_index, checkpoint, details)
+    return fail_task_on_error(task, chunks, "stream_task")
+
+def _json_chunks(task, vcodes, api_url, last_sequence, etag_store, hash_index, checkpoint, details):
+    context = fetch_context(task)
+    if not context:
+        raise ValueError("No context fetched for the task.")
+
+    yield f'{{"@context": {json_codec.dumps(context)}, "verenigingen": ['
+    written = 0
+    for vereniging in iter_task_verenigingen(task, vcodes, etag_store, hash_index, checkpoint, details):
+        if written:
+            yield ", "
+        yield json_codec.dumps(vereniging)
+        written += 1
+    yield f'], "url": {json_codec.dumps(api_url)}'
+    if last_sequence:
+        yield f', "sequence": {json_codec.dumps(last_sequence)}'
+    if hash_index:
+        yield f', "removedVCodes": {json_codec.dumps(hash_index.removed_vcodes())}'
+    yield "}"
+
+def fail_task_on_error(task, chunks, name):
+    """
+    Passes the chunks of a streaming task through, and marks the task FAILED if producing them raises.
+    Every error fails the task: a KeyError while streaming comes from malformed data, not from the configuration.
+    """
+    try:
+        yield from chunks
+    except Exception as e:
+        mark_task_failed(task["uri"])
+        logger.error(f"Error in {name}: {e}")
+        raise
+
+def stream_task_ndjson(task, vcodes, api_url = API_URL, last_sequence = None, etag_store = None, hash_index = None, checkpoint = None, details = None):
+    """
+    Newline-delimited counterpart of stream_task, meant to be consumed by save_ndjson_stream_on_disk.
+    Yields one line per record: a header record with the `@context`, `url` and `sequence`,
+    then one record per vereniging. In delta mode, a trailer record lists the `removedVCodes`.
+    Consumers can parse and import the verenigingen one line at a time.
+    """
+    lines = _ndjson_lines(task, vcodes, api_url, last_sequence, etag_store, hash_index, checkpoint, details)
+    return fail_task_on_error(task, lines, "stream_task_ndjson")
+
+def _ndjson_lines(task, vcodes, api_url, last_sequence, etag_store, hash_index, checkpoint, details):
+    context = fetch_context(task)
+    if not context:
+        raise ValueError("No context fetched for the task.")
+
+    header = { "@context": context, "url": api_url }
+    if last_sequence:
+        header["sequence"] = last_sequence
+    yield json_codec.dumps(header) + "\n"
+    for vereniging in iter_task_verenigingen(task, vcodes, etag_store, hash_index, checkpoint, details):
+        yield json_codec.dumps(vereniging) + "\n"
+    if hash_index:
+        yield json_codec.dumps({ "removedVCodes": hash_index.removed_vcodes() }) + "\n"
+
+def iter_task_verenigingen(task, vcodes, etag_store = None, hash_index = None, checkpoint = None, details = None):
+    """
+    Yields the transformed verenigingen to write for the given vCodes, fetching them one at a time
+    unless their `details` have been fetched already. With a hash_index, unchanged ones are left out.
+    """
+    if details is None:
+        details = iter_detail_urls(vcodes, task, etag_store=etag_store, checkpoint=checkpoint)
+    count = 0
+    for vereniging in iter_transform_data(details):
+        count += 1
+        if hash_index and not hash_index.record(vereniging):
+            continue
+        yield vereniging
+    if not count:
+        raise ValueError("No transformed data available.")
+
 def save_json_file_in_triplestore(physical_file_data):
     virtual_resource_uuid = str(uuid.uuid4())
     virtual_resource_uri = f"http://data.lblod.info/files/{virtual_resource_uuid}"
@@ -71,13 +158,16 @@ def save_json_file_in_triplestore(physical_file_data):
 
 
 def close_item(collection, task):
+    """Closes the task as SUCCESS or FAILED. Returns True only if it succeeded."""
     try:
         if collection_has_collected_files(collection):
             create_results_container(task["uri"], collection)
             update_task_status(task["uri"], TASK_STATUSES["SUCCESS"])
+            return True
         else:
             logger.error("no files collected closed without collecting files")
-            update_task_status(task["uri"], TASK_STATUSES["FAILED"])
+            mark_task_failed(task["uri"])
     except Exception as e:
         logger.error(e)
-        update_task_status(task["uri"], TASK_STATUSES["FAILED"])
+        mark_task_failed(task["uri"])
+    return False
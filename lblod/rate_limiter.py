@@ -0,0 +1,105 @@
+import time
+import random
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from helpers import logger
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter: a random delay in [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def parse_retry_after(value):
+    """Parses a Retry-After header (delay in seconds or an HTTP date). Returns seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Limits the requests to a single host, shared by all threads talking to it.
+    - A token bucket caps the request rate (`rate` requests/second, bursts up to `burst`).
+      A rate of 0 disables the bucket.
+    - The number of requests in flight is capped by a limit that adapts AIMD-style:
+      it grows by roughly one per window of successful requests, up to `max_concurrency`,
+      and is halved when the host throttles us. A burst of 429s answering requests that were all
+      in flight at the same time counts as one throttling event: only requests started after the
+      last decrease can lower the limit again.
+    - A throttle with Retry-After pauses all requests to the host until that time has passed,
+      instead of letting every worker hammer it and get throttled on its own.
+    """
+
+    def __init__(self, host, rate, burst, max_concurrency, min_concurrency=1):
+        self.host = host
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.min_concurrency = min_concurrency
+        self.limit = float(self.max_concurrency)
+        self.tokens = float(self.burst)
+        self.in_flight = 0
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        # Bumped on every decrease, to tell which requests were sent before it
+        self.generation = 0
+        self.condition = threading.Condition()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        """Waits for a request slot. Returns the generation to pass back to release."""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.paused_until - now
+                if wait <= 0 and self.in_flight >= int(self.limit):
+                    wait = None  # woken up by release
+                elif wait <= 0 and self.rate and self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                elif wait <= 0:
+                    if self.rate:
+                        self.tokens -= 1
+                    self.in_flight += 1
+                    return self.generation
+                self.condition.wait(wait)
+
+    def release(self, throttled=False, retry_after=None, generation=None):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                if retry_after:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                # A request sent before the last decrease was throttled under the old limit, already accounted for
+                if generation is None or generation == self.generation:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self.generation += 1
+                    logger.warning(f"Throttled by {self.host}, concurrency limit lowered to {int(self.limit)}")
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Holds a request slot. Set `throttled` (and `retry_after`) on the yielded state when the host answered 429."""
+        generation = self.acquire()
+        state = {"throttled": False, "retry_after": None}
+        try:
+            yield state
+        finally:
+            self.release(state["throttled"], state["retry_after"], generation)
@@ -1,8 +1,28 @@
-import copy
 import os
 import json
 import uuid
+import concurrent.futures
+import functools
+from collections import deque
+from itertools import chain, islice
 from helpers import logger
+from constants import TRANSFORM_PROCESSES, TRANSFORM_CHUNK_SIZE
+
+STATUSES = {
+    "actief": "http://lblod.data.gift/concepts/63cc561de9188d64ba5840a42ae8f0d6",
+    "niet actief": "http://lblod.data.gift/concepts/d02c4e12bf88d2fdf5123b07f29c9311",
+    "in oprichting": "http://lblod.data.gift/concepts/abf4fee82019f88cf122f986830621ab",
+    "gestopt": "http://lblod.data.gift/concepts/3d790fd9-bec9-43dd-840c-f835eda6997e",
+}
+
+# Location types used to pick a primary location when none is flagged as such, by order of preference
+PRIMARY_LOCATION_FALLBACK_TYPES = ["Maatschappelijke zetel volgens KBO", "Correspondentie"]
+
+# Location types known to the register. Their concept uuids are computed once, at import.
+KNOWN_LOCATION_TYPES = ["Maatschappelijke zetel volgens KBO", "Correspondentie", "Activiteiten"]
+
+_transformer = None
+
 
 def create_uuid_from_string(input_string):
     if input_string:
@@ -11,199 +31,259 @@ def create_uuid_from_string(input_string):
     return ""
 
 
-def transform_data(data):
+@functools.lru_cache(maxsize=1024)
+def create_concept_uuid(concept):
+    """
+    Memoised create_uuid_from_string, for concept-like strings that repeat across the register
+    (e.g. location types). Don't use it for unique values, they would only churn the cache.
+    """
+    return create_uuid_from_string(concept)
+
+
+LOCATION_TYPE_UUIDS = {
+    location_type: create_uuid_from_string(location_type)
+    for location_type in KNOWN_LOCATION_TYPES
+}
+
+
+def location_type_uuid(location_type):
+    return LOCATION_TYPE_UUIDS.get(location_type) or create_concept_uuid(location_type)
+
+
+def load_association_types():
     current_directory = os.path.dirname(os.path.realpath(__file__))
     json_file_path = os.path.join(current_directory, "types.json")
     with open(json_file_path, "r") as file:
-        association_types = json.load(file)
-    transformed_data = []
+        return json.load(file)
 
 
-    def create_location(locatie):
-        # pull the address-register URI if available
-        verwijst_naar_id = locatie.get("verwijstNaar", {}).get("@id")
+def get_transformer():
+    """Returns a shared transformer, so types.json is only read once per process."""
+    global _transformer
+    if _transformer is None:
+        _transformer = VerenigingTransformer(load_association_types())
+    return _transformer
 
-        # build the address representation
-        bestaat_uit = {
-            **locatie.get("adres", {}),
-            "adresvoorstelling": locatie.get("adresvoorstelling", ""),
-        }
 
-        # add adres:verwijstNaar as a linked @id if present
-        if verwijst_naar_id:
-            bestaat_uit["address:verwijstNaar"] = {"@id": verwijst_naar_id}
-
-        return {
-            "@id": locatie.get("@id", ""),
-            "locatieId": locatie.get("locatieId", ""),
-            "@type": locatie.get("@type", ""),
-            "description": locatie.get("naam", ""),
-            "locatieType": {
-                "@id": "con:"
-                + str(create_uuid_from_string(locatie.get("locatietype", ""))),
-                "@type": "concept:TypeVestiging",
-                "naam": locatie.get("locatietype", ""),
-            },
-            "bestaatUit": bestaat_uit,
-        }
+def transform_data(data):
+    return list(iter_transform_data(data))
 
-    def create_contact_point(contact):
-        new_contact = {
-            "@id": contact.get("@id", ""),
-            "contactgegevenId": contact.get("contactgegevenId", ""),
-            "@type": contact.get("@type", ""),
-            "contactgegeventype": contact["contactgegeventype"],
-        }
-        if contact["isPrimair"]:
-            new_contact["primairContact"] = "Primary"
-        else:
-            new_contact["primairContact"] = "Secondary"
-        if contact["contactgegeventype"] == "Telefoon":
-            new_contact["telefoon"] = contact["waarde"]
-        if contact["contactgegeventype"] == "E-mail":
-            new_contact["email"] = contact["waarde"]
-        if (
-            contact["contactgegeventype"] == "Website"
-            or contact["contactgegeventype"] == "SocialMedia"
-        ):
-            new_contact["website"] = contact["waarde"]
-        return new_contact
-
-    def create_contact_representative(contact):
-        new_contact = {
-            "@id": contact.get("@id", ""),
-            "@type": contact.get("@type", ""),
-        }
-        if "telefoon" in contact:
-            new_contact["telefoon"] = contact["telefoon"]
-        if "e-mail" in contact:
-            new_contact["email"] = contact["e-mail"]
-        if "socialMedia" in contact:
-            new_contact["website"] = contact["socialMedia"]
-        return new_contact
-
-    def create_representative(representative_data, v_code):
-        new_representative = {
-            "@id": f"lidmaatschap:{create_uuid_from_string(v_code + '_' + str(representative_data.get('vertegenwoordigerId')))}",
-            "vertegenwoordigerId": representative_data.get("vertegenwoordigerId", ""),
-            "@type": "org:Membership",
-            "vertegenwoordigerPersoon": {
-                "@id": representative_data.get("@id", ""),
-                "@type": representative_data.get("@type", ""),
-                "voornaam": representative_data.get("voornaam", ""),
-                "achternaam": representative_data.get("achternaam", ""),
-                "contactgegevens": [],
-            },
+
+def iter_transform_data(data):
+    """Lazily transform the given verenigingen, one at a time, so callers can
+    stream the result instead of holding the whole transformed list.
+    Uses a process pool when TRANSFORM_PROCESSES is set and there's more than one chunk of them:
+    a mutatiedienst run with a handful of changes isn't worth starting the worker processes for."""
+    if TRANSFORM_PROCESSES > 1:
+        data = iter(data)
+        head = list(islice(data, TRANSFORM_CHUNK_SIZE + 1))
+        if len(head) > TRANSFORM_CHUNK_SIZE:
+            yield from iter_transform_data_parallel(chain(head, data), TRANSFORM_PROCESSES, TRANSFORM_CHUNK_SIZE)
+            return
+        data = head
+    yield from get_transformer().iter_transform(data)
+
+
+def _transform_chunk(chunk):
+    return get_transformer().transform_all(chunk)
+
+
+def iter_transform_data_parallel(data, processes, chunk_size):
+    """
+    Shards the verenigingen in chunks over a pool of worker processes and yields the results in order.
+    Only a few chunks per worker are in flight at any time, so this can be fed a stream as well.
+    """
+    data = iter(data)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        try:
+            while True:
+                chunk = list(islice(data, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(_transform_chunk, chunk))
+                if len(pending) >= 2 * processes:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def create_location(locatie):
+    # pull the address-register URI if available
+    verwijst_naar_id = locatie.get("verwijstNaar", {}).get("@id")
+
+    # build the address representation
+    bestaat_uit = {
+        **locatie.get("adres", {}),
+        "adresvoorstelling": locatie.get("adresvoorstelling", ""),
+    }
+
+    # add adres:verwijstNaar as a linked @id if present
+    if verwijst_naar_id:
+        bestaat_uit["address:verwijstNaar"] = {"@id": verwijst_naar_id}
+
+    return {
+        "@id": locatie.get("@id", ""),
+        "locatieId": locatie.get("locatieId", ""),
+        "@type": locatie.get("@type", ""),
+        "description": locatie.get("naam", ""),
+        "locatieType": {
+            "@id": "con:"
+            + str(location_type_uuid(locatie.get("locatietype", ""))),
+            "@type": "concept:TypeVestiging",
+            "naam": locatie.get("locatietype", ""),
+        },
+        "bestaatUit": bestaat_uit,
+    }
+
+
+def create_contact_point(contact):
+    new_contact = {
+        "@id": contact.get("@id", ""),
+        "contactgegevenId": contact.get("contactgegevenId", ""),
+        "@type": contact.get("@type", ""),
+        "contactgegeventype": contact["contactgegeventype"],
+    }
+    if contact["isPrimair"]:
+        new_contact["primairContact"] = "Primary"
+    else:
+        new_contact["primairContact"] = "Secondary"
+    if contact["contactgegeventype"] == "Telefoon":
+        new_contact["telefoon"] = contact["waarde"]
+    if contact["contactgegeventype"] == "E-mail":
+        new_contact["email"] = contact["waarde"]
+    if (
+        contact["contactgegeventype"] == "Website"
+        or contact["contactgegeventype"] == "SocialMedia"
+    ):
+        new_contact["website"] = contact["waarde"]
+    return new_contact
+
+
+def create_contact_representative(contact):
+    new_contact = {
+        "@id": contact.get("@id", ""),
+        "@type": contact.get("@type", ""),
+    }
+    if "telefoon" in contact:
+        new_contact["telefoon"] = contact["telefoon"]
+    if "e-mail" in contact:
+        new_contact["email"] = contact["e-mail"]
+    if "socialMedia" in contact:
+        new_contact["website"] = contact["socialMedia"]
+    return new_contact
+
+
+def create_representative(representative_data, v_code):
+    new_representative = {
+        "@id": f"lidmaatschap:{create_uuid_from_string(v_code + '_' + str(representative_data.get('vertegenwoordigerId')))}",
+        "vertegenwoordigerId": representative_data.get("vertegenwoordigerId", ""),
+        "@type": "org:Membership",
+        "vertegenwoordigerPersoon": {
+            "@id": representative_data.get("@id", ""),
+            "@type": representative_data.get("@type", ""),
+            "voornaam": representative_data.get("voornaam", ""),
+            "achternaam": representative_data.get("achternaam", ""),
+            "contactgegevens": [],
+        },
+    }
+
+    if representative_data.get("isPrimair", False):
+        new_representative["primaireVertegenwoordiger"] = { "@id": "lblodconcept:75e74415-35cf-4da5-bac5-b72a1c137799" }
+    else:
+        new_representative["primaireVertegenwoordiger"] = { "@id": "lblodconcept:78451ac5-ec0b-469d-b918-0a8ef92a77b2" }
+
+    contact_info = representative_data.get("vertegenwoordigerContactgegevens", [])
+    if contact_info:
+        new_representative["vertegenwoordigerPersoon"]["contactgegevens"].append(
+            create_contact_representative(contact_info)
+        )
+    return new_representative
+
+
+class VerenigingTransformer:
+    """
+    Transforms verenigingen as returned by the register into our JSON-LD shape.
+    The association types are indexed by code once, at construction.
+    Items are transformed in place: the raw item given to `transform` must not be reused afterwards.
+    """
+
+    def __init__(self, association_types):
+        self.association_type_ids = {
+            assoc_type["code"]: assoc_type.get("@id", "")
+            for assoc_type in association_types
+            if "code" in assoc_type and "@id" in assoc_type
         }
 
-        if representative_data.get("isPrimair", False):
-            new_representative["primaireVertegenwoordiger"] = { "@id": "lblodconcept:75e74415-35cf-4da5-bac5-b72a1c137799" }
-        else:
-            new_representative["primaireVertegenwoordiger"] = { "@id": "lblodconcept:78451ac5-ec0b-469d-b918-0a8ef92a77b2" }
+    def transform_all(self, data):
+        return list(self.iter_transform(data))
 
-        contact_info = representative_data.get("vertegenwoordigerContactgegevens", [])
-        if contact_info:
-            new_representative["vertegenwoordigerPersoon"]["contactgegevens"].append(
-                create_contact_representative(contact_info)
-            )
-        return new_representative
+    def iter_transform(self, data):
+        for item in data:
+            vereniging = self.transform(item)
+            if vereniging is not None:
+                yield vereniging
 
-    for item in data:
+    def transform(self, item):
+        """Returns the transformed vereniging, or None if it has to be skipped."""
         if item.get("type") == "RemovedResource":
             #TODO: revise pipeline. It's okay to skip these here.
             logger.info(f"Found a {item['type']} for {item['vCode']}. Skipping")
-            continue
+            return None
 
-        vereniging = copy.deepcopy(item)
+        vereniging = item
         v_code = vereniging.get("vCode", "")
-        primary_location = None
-        locaties = []
-        contact_gegevens = []
-        vertegenwoordigers = []
-        status = None
 
         # ASSOCIATION TYPES
-        for assoc_type in association_types:
-            if "code" in assoc_type and "@id" in assoc_type:
-                verenigingstype = vereniging.get(
-                    "verenigingstype", {}
-                )  # Use get() with a default empty dictionary
-                if "code" in verenigingstype and assoc_type[
-                    "code"
-                ] == verenigingstype.get("code", ""):
-                    verenigingstype["@id"] = assoc_type.get("@id", "")
-                    vereniging["verenigingstype"] = verenigingstype
+        verenigingstype = vereniging.get("verenigingstype", {})
+        if "code" in verenigingstype:
+            type_id = self.association_type_ids.get(verenigingstype["code"])
+            if type_id is not None:
+                verenigingstype["@id"] = type_id
+                vereniging["verenigingstype"] = verenigingstype
 
         # IDENTIFIERS
         for sleutel in vereniging["sleutels"]:
-            if "codeerSysteem" in sleutel:
-                if sleutel["codeerSysteem"] == "Vcode":
-                    sleutel["codeerSysteem"] = "vCode"
+            if sleutel.get("codeerSysteem") == "Vcode":
+                sleutel["codeerSysteem"] = "vCode"
 
         # LOCATIES
-
         if 'locaties' not in item:
             logger.warning(f"We have found vereniging {v_code} with no location. Skipping import, since our apps rely on this")
-            continue
+            return None
 
+        primary_location = None
+        locaties = []
         for locatie in item["locaties"]:
-            if "isPrimair" in locatie and locatie["isPrimair"]:
+            if locatie.get("isPrimair"):
                 primary_location = create_location(locatie)
             else:
                 locaties.append(create_location(locatie))
 
+        if not primary_location:
+            primary_location = self.pop_fallback_primary_location(locaties)
+        elif primary_location in locaties:
+            # A location duplicating the flagged primary one is only listed as primary
+            locaties.remove(primary_location)
+
         # CONTACTGEGEVENS
-        if "contactgegevens" in item and item["contactgegevens"]:
-            for contact in item["contactgegevens"]:
-                contact_gegevens.append(create_contact_point(contact))
+        contact_gegevens = [create_contact_point(contact) for contact in item.get("contactgegevens") or []]
 
         # VERTEGENWOORDIGERS
-        if "vertegenwoordigers" in item and item["vertegenwoordigers"]:
-            for vertegenwoordiger in item["vertegenwoordigers"]:
-                vertegenwoordigers.append(
-                    create_representative(vertegenwoordiger, v_code)
-                )
+        vertegenwoordigers = [
+            create_representative(vertegenwoordiger, v_code)
+            for vertegenwoordiger in item.get("vertegenwoordigers") or []
+        ]
 
         # STATUS MAPPING
+        status = None
         if "status" in item:
-            formatted_status = item["status"].strip().lower()
-            if formatted_status == "actief":
-                status = {
-                    "@id": "http://lblod.data.gift/concepts/63cc561de9188d64ba5840a42ae8f0d6"
-                }
-            elif formatted_status == "niet actief":
-                status = {
-                    "@id": "http://lblod.data.gift/concepts/d02c4e12bf88d2fdf5123b07f29c9311"
-                }
-            elif formatted_status == "in oprichting":
-                status = {
-                    "@id": "http://lblod.data.gift/concepts/abf4fee82019f88cf122f986830621ab"
-                }
-            elif formatted_status == "gestopt":
-                status = {
-                    "@id": "http://lblod.data.gift/concepts/3d790fd9-bec9-43dd-840c-f835eda6997e"
-                }
-
-        if not primary_location:
-            for locatie in locaties:
-                if (
-                    locatie.get("locatieType", {}).get("naam")
-                    == "Maatschappelijke zetel volgens KBO"
-                ):
-                    primary_location = locatie
-                    break
-
-            if not primary_location:
-                for locatie in locaties:
-                    if locatie.get("locatieType", {}).get("naam") == "Correspondentie":
-                        primary_location = locatie
-                        break
-
-                if not primary_location:
-                    primary_location = locaties[0] if locaties else None
-
-        if primary_location and primary_location in locaties:
-            locaties.remove(primary_location)
+            status_id = STATUSES.get(item["status"].strip().lower())
+            if status_id:
+                status = { "@id": status_id }
 
         vereniging["primaireLocatie"] = primary_location
         vereniging["locaties"] = locaties
@@ -215,5 +295,18 @@ def transform_data(data):
         )
         if status:
             vereniging["status"] = status
-        transformed_data.append(vereniging)
-    return transformed_data
+        return vereniging
+
+    @staticmethod
+    def pop_fallback_primary_location(locaties):
+        """
+        Picks the primary location by type when none is flagged as primary,
+        falling back to the first location, and removes it from `locaties`.
+        """
+        if not locaties:
+            return None
+        for location_type in PRIMARY_LOCATION_FALLBACK_TYPES:
+            for index, locatie in enumerate(locaties):
+                if locatie["locatieType"]["naam"] == location_type:
+                    return locaties.pop(index)
+        return locaties.pop(0)
@@ -1,21 +1,110 @@
+from contextlib import contextmanager
 from datetime import datetime, timezone
 import os
+import random
+import re
+import threading
 import time
 
-from SPARQLWrapper import SPARQLWrapper, JSON
+import requests
+from requests.adapters import HTTPAdapter
 from helpers import logger
 
-sparqlQuery = SPARQLWrapper(os.environ.get("MU_SPARQL_ENDPOINT"), returnFormat=JSON)
-sparqlQuery.addCustomHttpHeader("mu-auth-sudo", "true")
-sparqlUpdate = SPARQLWrapper(os.environ.get("MU_SPARQL_UPDATEPOINT"), returnFormat=JSON)
-sparqlUpdate.method = "POST"
-sparqlUpdate.addCustomHttpHeader("mu-auth-sudo", "true")
+SPARQL_POOL_SIZE = int(os.environ.get("SPARQL_POOL_SIZE", "10"))
+SPARQL_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("SPARQL_CONNECT_TIMEOUT_SECONDS", "5"))
+SPARQL_READ_TIMEOUT_SECONDS = float(os.environ.get("SPARQL_READ_TIMEOUT_SECONDS", "60"))
 
-authSparqlUpdate = SPARQLWrapper(os.environ.get("MU_AUTH_ENDPOINT"), returnFormat=JSON)
-authSparqlUpdate.method = "POST"
-authSparqlUpdate.addCustomHttpHeader("mu-auth-sudo", "true")
+# Update operations, possibly preceded by PREFIX/BASE declarations
+UPDATE_QUERY_PATTERN = re.compile(
+    r"^\s*(?:(?:PREFIX\s+[^\s:]*:\s*<[^>]*>|BASE\s*<[^>]*>)\s*)*(?:INSERT|DELETE|LOAD|CLEAR|CREATE|DROP|COPY|MOVE|ADD|WITH)\b",
+    re.IGNORECASE
+)
+COMMENT_LINE_PATTERN = re.compile(r"^\s*#.*$", re.MULTILINE)
 
 
+def is_update_query(the_query):
+    return bool(UPDATE_QUERY_PATTERN.match(COMMENT_LINE_PATTERN.sub("", the_query)))
+
+
+class SparqlClient:
+    """
+    Client for one SPARQL endpoint, safe to share between threads.
+    Every call sends its own request, so no query state is shared between callers.
+    Connections are pooled and kept alive, so concurrent callers run in parallel
+    without reconnecting for every query.
+    Every request is bounded by a connect and a read timeout, so a hung connection
+    fails the attempt instead of blocking its caller forever.
+    """
+
+    def __init__(self, endpoint, pool_size=SPARQL_POOL_SIZE,
+                 timeout=(SPARQL_CONNECT_TIMEOUT_SECONDS, SPARQL_READ_TIMEOUT_SECONDS)):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"mu-auth-sudo": "true"})
+
+    def query(self, the_query):
+        response = self.session.post(self.endpoint,
+                                     data={"query": the_query},
+                                     headers={"Accept": "application/sparql-results+json"},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def update(self, the_query):
+        response = self.session.post(self.endpoint,
+                                     data={"update": the_query},
+                                     headers={"Accept": "application/sparql-results+json"},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+
+
+sparqlQuery = SparqlClient(os.environ.get("MU_SPARQL_ENDPOINT"))
+sparqlUpdate = SparqlClient(os.environ.get("MU_SPARQL_UPDATEPOINT"))
+authSparqlUpdate = SparqlClient(os.environ.get("MU_AUTH_ENDPOINT"))
+
+_batch = threading.local()
+
+
+class RetryPolicy:
+    """
+    Retries a call with exponential backoff and full jitter, within a total time budget.
+    Gives up, re-raising the last error, after `max_attempts` attempts or when the next
+    attempt would start after `deadline` seconds, whichever comes first.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=10.0, deadline=30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def run(self, call):
+        give_up_at = time.monotonic() + self.deadline
+        for attempt in range(self.max_attempts):
+            try:
+                return call()
+            except Exception as e:
+                wait_time = self.delay(attempt)
+                if attempt + 1 >= self.max_attempts or time.monotonic() + wait_time > give_up_at:
+                    logger.error(f"Executing query failed, giving up after {attempt + 1} attempts: {e}")
+                    raise
+                logger.warning(f"Executing query failed unexpectedly: {e}")
+                logger.warning(f"Retrying after {wait_time:.1f} seconds [{attempt + 1}/{self.max_attempts}]")
+                time.sleep(wait_time)
+
+
+DEFAULT_UPDATE_RETRY_POLICY = RetryPolicy(
+    max_attempts=int(os.environ.get("SPARQL_UPDATE_MAX_ATTEMPTS", "5")),
+    deadline=float(os.environ.get("SPARQL_UPDATE_RETRY_DEADLINE_SECONDS", "30"))
+)
+
 
 def query_sudo(the_query):
     """Execute the given SPARQL query (select/ask/construct)on the triple store and returns the results
@@ -23,45 +112,73 @@ def query_sudo(the_query):
     start = time.time()
     logger.debug(f"started query at {datetime.now(timezone.utc)}")
     logger.debug("execute query: \n" + the_query)
-    sparqlQuery.setQuery(the_query)
+    result = sparqlQuery.query(the_query)
     logger.debug(f"query took {time.time() - start} seconds")
-    return sparqlQuery.query().convert()
+    return result
 
 
-def update_sudo(the_query, attempt=0, max_retries=5):
-    """Execute the given update SPARQL query on the triple store,
-    if the given query is no update query, nothing happens."""
-    sparqlUpdate.setQuery(the_query)
-    if sparqlUpdate.isSparqlUpdateRequest():
+@contextmanager
+def update_batch():
+    """
+    Unit of work for updates: while the block runs, update_sudo calls made from this thread
+    are collected instead of executed, and sent as one combined update request when the block exits
+    (also when it exits with an exception, so failure bookkeeping is written too).
+    Reads made inside the block don't see the collected updates yet.
+    Nested blocks join the outer one.
+    """
+    if getattr(_batch, "queries", None) is not None:
+        yield
+        return
+    _batch.queries = []
+    try:
+        yield
+    except BaseException:
+        # Keep the error of the block: a failing flush is only logged
         try:
+            _flush_batch()
+        except Exception as e:
+            logger.error(f"Could not flush the updates of a failed batch: {e}")
+        raise
+    _flush_batch()
+
+
+def _flush_batch():
+    queries = _batch.queries
+    _batch.queries = None
+    if queries:
+        logger.debug(f"Flushing batch of {len(queries)} updates")
+        update_sudo(";\n".join(queries))
+
+
+def update_sudo(the_query, retry_policy=None):
+    """Execute the given update SPARQL query on the triple store,
+    if the given query is no update query, nothing happens.
+    Failed attempts are retried according to the retry policy; once it gives up, the error is raised.
+    Inside an update_batch block, the query is queued instead."""
+    if getattr(_batch, "queries", None) is not None:
+        _batch.queries.append(the_query)
+        return
+    if is_update_query(the_query):
+        def execute():
             start = time.time()
             logger.debug(f"started query at {datetime.now(timezone.utc)}")
             logger.debug("execute query: \n" + the_query)
 
-            sparqlUpdate.query()
+            sparqlUpdate.update(the_query)
 
             logger.debug(f"query took {time.time() - start} seconds")
-        except Exception as e:
-            logger.warning(f"Executing query failed unexpectedly. Stacktrace:", e)
-            if attempt <= max_retries:
-                wait_time = 0.6 * attempt + 30
-                logger.warning(f"Retrying after {wait_time} seconds [{attempt}/{max_retries}]")
-                time.sleep(wait_time)
 
-                update_sudo(the_query, attempt + 1, max_retries)
-            else:
-                logger.warning(f"Max attempts reached for query. Skipping.")
+        (retry_policy or DEFAULT_UPDATE_RETRY_POLICY).run(execute)
 
 
 def auth_update_sudo(the_query):
     """Execute the given update SPARQL query on the triple store,
     if the given query is no update query, nothing happens."""
-    authSparqlUpdate.setQuery(the_query)
-    if authSparqlUpdate.isSparqlUpdateRequest():
+    if is_update_query(the_query):
         start = time.time()
         logger.debug(f"started query at {datetime.now(timezone.utc)}")
         logger.debug("execute query: \n" + the_query)
 
-        authSparqlUpdate.query()
+        authSparqlUpdate.update(the_query)
 
         logger.debug(f"query took {time.time() - start} seconds")
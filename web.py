@@ -3,19 +3,30 @@ import os
 from flask import jsonify, request
 from flask_executor import Executor
 
-from lblod.pipeline import close_item, process_task, save_json_file_in_triplestore
-from lblod.file import save_json_on_disk
-from lblod.job import load_task, update_task_status, TaskNotFoundException
+from lblod.pipeline import close_item, process_task, stream_task, stream_task_ndjson, save_json_file_in_triplestore
+from lblod.file import save_json_on_disk, save_json_stream_on_disk, save_ndjson_stream_on_disk
+from lblod.job import load_task, update_task_status, mark_task_failed, TaskNotFoundException
 from lblod.harvester import get_harvest_collection_for_task, get_initial_remote_data_object
-from lblod.data_fetcher import fetch_vcodes
+from lblod.data_fetcher import iter_vcodes
+from lblod.etag_store import get_etag_store
+from lblod.hash_index import HashIndex
+from lblod.checkpoint import Checkpoint, remove_stale_checkpoints
 from constants import OPERATIONS, \
     TASK_STATUSES, \
-    MUTATIEDIENST_SYNC_INTERVAL_SECONDS, \
+    MUTATIEDIENST_SYNC_MIN_INTERVAL_SECONDS, \
+    MUTATIEDIENST_SYNC_MAX_INTERVAL_SECONDS, \
     MUTATIEDIENST_SYNC_INTERVAL_ACTIVITY_WINDOW, \
+    FULL_SYNC_STREAMING, \
+    FULL_SYNC_OUTPUT_MODE, \
+    HARVEST_OUTPUT_FORMAT, \
+    FULL_SYNC_CHECKPOINTING, \
+    CHECKPOINT_MAX_AGE_DAYS, \
+    HASH_INDEX_PATH, \
     API_URL
 
-from lblod.helpers import fetch_data_mutatiedienst
-from lblod.mutatiedienst_scheduler import run_mutatiedienst_pipeline
+from lblod.helpers import fetch_latest_sequence
+from lblod.mutatiedienst_scheduler import run_mutatiedienst_pipeline, invalidate_sequence_cache, \
+    AdaptiveInterval, RUN_IDLE
 from helpers import logger
 from sudo_query import query_sudo
 
@@ -27,28 +38,49 @@ MU_APPLICATION_FILE_STORAGE_PATH = os.getenv(
 
 executor = Executor(app)
 
+from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 
 scheduler = BackgroundScheduler()
 
-logger.info(f"Mutatiedienst sync interval (in seconds): {MUTATIEDIENST_SYNC_INTERVAL_SECONDS}")
+logger.info(f"Mutatiedienst sync interval (in seconds): {MUTATIEDIENST_SYNC_MIN_INTERVAL_SECONDS}-{MUTATIEDIENST_SYNC_MAX_INTERVAL_SECONDS}")
 logger.info(f"Mutatiedienst sync interval activity window of the day: {MUTATIEDIENST_SYNC_INTERVAL_ACTIVITY_WINDOW}")
 
+mutatiedienst_interval = AdaptiveInterval(MUTATIEDIENST_SYNC_MIN_INTERVAL_SECONDS,
+                                          MUTATIEDIENST_SYNC_MAX_INTERVAL_SECONDS)
+# Matches every second within the activity window
+mutatiedienst_activity_window = CronTrigger(hour=MUTATIEDIENST_SYNC_INTERVAL_ACTIVITY_WINDOW,
+                                            minute="*",
+                                            second="*")
+
+def schedule_mutatiedienst_job(delay):
+    run_at = datetime.now(mutatiedienst_activity_window.timezone) + timedelta(seconds=delay)
+    # Outside the activity window, this is postponed to the start of the next one.
+    run_at = mutatiedienst_activity_window.get_next_fire_time(None, run_at)
+    scheduler.add_job(wrapped_job_mutatiedienst,
+                      'date',
+                      run_date=run_at,
+                      id="mutatiedienst",
+                      replace_existing=True,
+                      # Each run schedules the next one: a run that is late must still happen,
+                      # or the chain ends and the mutatiedienst stops until a restart.
+                      misfire_grace_time=None,
+                      coalesce=True)
+
 def wrapped_job_mutatiedienst():
+    outcome = RUN_IDLE
     try:
-        run_mutatiedienst_pipeline()
+        outcome = run_mutatiedienst_pipeline()
     except Exception as err:
         # TODO: store error
         logger.error(f"An error occured during the scheduling of mutatiedienst pipeline. (i.e. before the real job starts)")
         logger.error(f"{err}")
+    finally:
+        # Every run schedules the next one, after an interval adapted to what this run found.
+        schedule_mutatiedienst_job(mutatiedienst_interval.next(outcome))
 
-scheduler.add_job(wrapped_job_mutatiedienst,
-                  'cron',
-                  second=MUTATIEDIENST_SYNC_INTERVAL_SECONDS,
-                  hour=MUTATIEDIENST_SYNC_INTERVAL_ACTIVITY_WINDOW,
-                  max_instances=1,
-                  coalesce=True)
+schedule_mutatiedienst_job(0)
 # Note : while running this service in development mode, you might notice that the jobs are executed twice
 # It's related to the debug mode of Flask, which does not apply to the built version.)
 scheduler.start()
@@ -87,18 +119,44 @@ def process_delta():
                     sequence_data = help_generate_mutatiedienst_new_sequence_object()
                     collection = get_harvest_collection_for_task(task)
                     rdo = get_initial_remote_data_object(collection)
-                    vcodes = fetch_vcodes(task)
-
-                    data = process_task(task, vcodes, API_URL, sequence_data)
-                    json_file_data = save_json_on_disk(data, rdo)
+                    checkpoint = None
+                    if FULL_SYNC_CHECKPOINTING:
+                        remove_stale_checkpoints(CHECKPOINT_MAX_AGE_DAYS, keep=task["id"])
+                        checkpoint = Checkpoint.for_task(task)
+                    if checkpoint and checkpoint.has_vcodes():
+                        vcodes = checkpoint.load_vcodes()
+                    else:
+                        # Lazy: details are fetched while the postcode searches are still running
+                        vcodes = iter_vcodes(task)
+                        if checkpoint:
+                            vcodes = checkpoint.record_vcodes(vcodes)
+                    etag_store = get_etag_store()
+                    hash_index = HashIndex.load(HASH_INDEX_PATH) if FULL_SYNC_OUTPUT_MODE == "delta" else None
+
+                    if HARVEST_OUTPUT_FORMAT == "ndjson":
+                        lines = stream_task_ndjson(task, vcodes, API_URL, sequence_data, etag_store, hash_index, checkpoint)
+                        json_file_data = save_ndjson_stream_on_disk(lines, rdo)
+                    elif FULL_SYNC_STREAMING:
+                        chunks = stream_task(task, vcodes, API_URL, sequence_data, etag_store, hash_index, checkpoint)
+                        json_file_data = save_json_stream_on_disk(chunks, rdo)
+                    else:
+                        data = process_task(task, vcodes, API_URL, sequence_data, etag_store, hash_index, checkpoint)
+                        json_file_data = save_json_on_disk(data, rdo)
                     try:
                         save_json_file_in_triplestore(json_file_data)
-                        close_item(collection, task)
+                        if close_item(collection, task):
+                            # The next delta is relative to this output: only keep its hashes once it's been stored
+                            if hash_index:
+                                hash_index.commit()
+                            # A failed task keeps its checkpoint, so the retry resumes from it
+                            if checkpoint:
+                                checkpoint.clear()
+                        # The full sync carries a new sequence for the mutatiedienst
+                        invalidate_sequence_cache()
                     except Exception as e:
                         logger.error(
                             f"Encountered exception while trying to write data to triplestore - {task['uri']}")
-                        update_task_status(
-                            task["uri"], TASK_STATUSES["FAILED"])
+                        mark_task_failed(task["uri"])
                         raise e from None
                 else:
                     print("Task is not in the 'COLLECTING' state.")
@@ -111,8 +169,11 @@ def process_delta():
 def help_generate_mutatiedienst_new_sequence_object():
     # Get the URI of the MutatiedienstStateInfo
     query_string = """
-      SELECT DISTINCT ?subject WHERE {
+      SELECT DISTINCT ?subject ?since WHERE {
          ?subject a <http://data.lblod.info/vocabularies/FeitelijkeVerenigingen/MutatiedienstStateInfo>.
+         OPTIONAL {
+           ?subject <http://data.lblod.info/vocabularies/FeitelijkeVerenigingen/lastSequenceMutatiedienst> ?since.
+         }
       }
     """
     result = query_sudo(query_string)
@@ -120,8 +181,9 @@ def help_generate_mutatiedienst_new_sequence_object():
         raise Exception(f"Too many MutatiedienstStateInfo resources stored in database: {len(result['results']['bindings'])}")
 
     subject = result["results"]["bindings"][0]["subject"]["value"]
-    mutatiedienst_changes = fetch_data_mutatiedienst();
-    last_sequence = mutatiedienst_changes[-1]["sequence"] # Assumes it's a sorted list
+    # Only the changes after the stored sequence are needed to find the latest one
+    since = result["results"]["bindings"][0].get("since", {}).get("value", 0)
+    last_sequence = fetch_latest_sequence(since)
 
     if not last_sequence:
         raise Exception(f"No last sequence found from mutatiedienst. Failing full harvest.")